@@ -0,0 +1,262 @@
+import hashlib
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+
+###########################################################
+# Mock COS Config
+###########################################################
+# Bodies up to this size are kept so small objects (e.g. indexes) can be read back.
+MOCK_COS_KEEP_BODY_SIZE = 1024 * 1024
+MOCK_COS_HEADERS = ("content-type", "content-encoding", "content-disposition", "content-language", "cache-control", "expires")
+
+
+class CosState:
+    def __init__(self, latency: float = 0.0, throttle_rate: float = 0.0, bandwidth: float = 0.0):
+        self.lock = threading.Lock()
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.bandwidth = bandwidth
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.objects = {}
+            self.uploads = {}
+            self.requests = 0
+            self.throttled = 0
+            self.bytes_received = 0
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def xml(root: str, body: str) -> bytes:
+    return f'<?xml version="1.0" encoding="UTF-8"?>\n<{root}>{body}</{root}>'.encode("utf-8")
+
+
+def tag(name: str, value) -> str:
+    return f"<{name}>{escape(str(value))}</{name}>"
+
+
+class CosHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: CosState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return b"".join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def reply(self, status: int, body: bytes = b"", headers: dict | None = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("x-cos-request-id", uuid.uuid4().hex)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def error(self, status: int, code: str, message: str = ""):
+        body = xml("Error", tag("Code", code) + tag("Message", message) + tag("RequestId", uuid.uuid4().hex))
+        self.reply(status, body, {"Content-Type": "application/xml"})
+
+    def object_headers(self) -> dict:
+        return {
+            name.lower(): value for name, value in self.headers.items()
+            if name.lower() in MOCK_COS_HEADERS or name.lower().startswith("x-cos-meta-")
+        }
+
+    def handle_request(self):
+        url = urlparse(self.path)
+        key = unquote(url.path.lstrip("/"))
+        query = {name: values[0] for name, values in parse_qs(url.query, keep_blank_values=True).items()}
+        body = self.read_body()
+
+        # Simulate network latency, limited bandwidth and throttling.
+        state = self.state
+        delay = state.latency
+        if state.bandwidth:
+            delay += len(body) / state.bandwidth
+        if delay:
+            time.sleep(delay)
+        with state.lock:
+            state.requests += 1
+            state.bytes_received += len(body)
+            throttled = random.random() < state.throttle_rate
+            state.throttled += throttled
+        if throttled:
+            return self.error(503, "SlowDown", "Please reduce your request rate.")
+
+        method = self.command
+        if method == "GET" and not key:
+            return self.list_objects(query)
+        if method == "POST" and not key and "delete" in query:
+            return self.delete_objects(body)
+        if method == "POST" and "uploads" in query:
+            return self.create_multipart_upload(key)
+        if method == "PUT" and "uploadId" in query:
+            return self.upload_part(query, body)
+        if method == "GET" and "uploadId" in query:
+            return self.list_parts(key, query)
+        if method == "POST" and "uploadId" in query:
+            return self.complete_multipart_upload(key, query, body)
+        if method == "DELETE" and "uploadId" in query:
+            with state.lock:
+                state.uploads.pop(query["uploadId"], None)
+            return self.reply(204)
+        if method == "PUT" and "x-cos-copy-source" in self.headers:
+            return self.copy_object(key)
+        if method == "PUT":
+            return self.put_object(key, body)
+        if method in ("GET", "HEAD"):
+            return self.get_object(key)
+        if method == "DELETE":
+            with state.lock:
+                state.objects.pop(key, None)
+            return self.reply(204)
+        return self.error(405, "MethodNotAllowed")
+
+    do_GET = do_HEAD = do_PUT = do_POST = do_DELETE = handle_request
+
+    def store(self, key: str, etag: str, size: int, headers: dict, body: bytes | None = None):
+        with self.state.lock:
+            self.state.objects[key] = {
+                "etag": etag,
+                "size": size,
+                "headers": headers,
+                "body": body if body is not None and size <= MOCK_COS_KEEP_BODY_SIZE else None,
+                "modified": now_iso(),
+            }
+
+    def put_object(self, key: str, body: bytes):
+        etag = hashlib.md5(body).hexdigest()
+        self.store(key, etag, len(body), self.object_headers(), body)
+        self.reply(200, headers={"ETag": f'"{etag}"'})
+
+    def get_object(self, key: str):
+        with self.state.lock:
+            obj = self.state.objects.get(key)
+        if obj is None:
+            return self.error(404, "NoSuchKey", "The specified key does not exist.")
+        headers = {"ETag": f'"{obj["etag"]}"', "Last-Modified": obj["modified"], **obj["headers"]}
+        body = obj["body"] if obj["body"] is not None else b"\0" * obj["size"]
+        if self.command == "HEAD":
+            self.send_response(200)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(obj["size"]))
+            self.end_headers()
+            return
+        self.reply(200, body, headers)
+
+    def copy_object(self, key: str):
+        # The copy source looks like "<bucket>.cos.<region>.myqcloud.com/<key>".
+        source = unquote(self.headers["x-cos-copy-source"].split("/", 1)[1])
+        with self.state.lock:
+            obj = self.state.objects.get(source)
+        if obj is None:
+            return self.error(404, "NoSuchKey", f"The copy source {source} does not exist.")
+        replaced = self.headers.get("x-cos-metadata-directive", "Copy").lower() == "replaced"
+        headers = self.object_headers() if replaced else dict(obj["headers"])
+        self.store(key, obj["etag"], obj["size"], headers, obj["body"])
+        self.reply(200, xml("CopyObjectResult", tag("ETag", f'"{obj["etag"]}"') + tag("LastModified", now_iso())))
+
+    def list_objects(self, query: dict):
+        prefix = query.get("prefix", "")
+        marker = query.get("marker", "")
+        max_keys = int(query.get("max-keys", 1000))
+        with self.state.lock:
+            keys = sorted(key for key in self.state.objects if key.startswith(prefix) and key > marker)
+            page = [(key, self.state.objects[key]) for key in keys[:max_keys]]
+        truncated = len(keys) > max_keys
+        body = tag("Name", "bench") + tag("Prefix", prefix) + tag("Marker", marker) + tag("MaxKeys", max_keys)
+        body += tag("IsTruncated", "true" if truncated else "false")
+        if truncated:
+            body += tag("NextMarker", page[-1][0])
+        for key, obj in page:
+            body += "<Contents>" + tag("Key", key) + tag("LastModified", obj["modified"]) + tag("ETag", f'"{obj["etag"]}"')
+            body += tag("Size", obj["size"]) + tag("StorageClass", "STANDARD") + "</Contents>"
+        self.reply(200, xml("ListBucketResult", body), {"Content-Type": "application/xml"})
+
+    def delete_objects(self, body: bytes):
+        keys = [element.text for element in ElementTree.fromstring(body).iter("Key")]
+        with self.state.lock:
+            for key in keys:
+                self.state.objects.pop(key, None)
+        deleted = "".join(f"<Deleted>{tag('Key', key)}</Deleted>" for key in keys)
+        self.reply(200, xml("DeleteResult", deleted), {"Content-Type": "application/xml"})
+
+    def create_multipart_upload(self, key: str):
+        upload_id = uuid.uuid4().hex
+        with self.state.lock:
+            self.state.uploads[upload_id] = {"key": key, "parts": {}, "headers": self.object_headers()}
+        body = tag("Bucket", "bench") + tag("Key", key) + tag("UploadId", upload_id)
+        self.reply(200, xml("InitiateMultipartUploadResult", body), {"Content-Type": "application/xml"})
+
+    def upload_part(self, query: dict, body: bytes):
+        digest = hashlib.md5(body)
+        with self.state.lock:
+            upload = self.state.uploads.get(query["uploadId"])
+            if upload is not None:
+                upload["parts"][int(query["partNumber"])] = {"digest": digest.digest(), "size": len(body), "etag": digest.hexdigest()}
+        if upload is None:
+            return self.error(404, "NoSuchUpload")
+        self.reply(200, headers={"ETag": f'"{digest.hexdigest()}"'})
+
+    def list_parts(self, key: str, query: dict):
+        marker = int(query.get("part-number-marker", 0) or 0)
+        max_parts = int(query.get("max-parts", 1000))
+        with self.state.lock:
+            upload = self.state.uploads.get(query["uploadId"])
+            parts = sorted((number, part) for number, part in (upload or {"parts": {}})["parts"].items() if number > marker)
+        if upload is None:
+            return self.error(404, "NoSuchUpload")
+        page = parts[:max_parts]
+        body = tag("Bucket", "bench") + tag("Key", key) + tag("UploadId", query["uploadId"])
+        body += tag("IsTruncated", "true" if len(parts) > max_parts else "false")
+        if page:
+            body += tag("NextPartNumberMarker", page[-1][0])
+        for number, part in page:
+            body += "<Part>" + tag("PartNumber", number) + tag("LastModified", now_iso())
+            body += tag("ETag", f'"{part["etag"]}"') + tag("Size", part["size"]) + "</Part>"
+        self.reply(200, xml("ListPartsResult", body), {"Content-Type": "application/xml"})
+
+    def complete_multipart_upload(self, key: str, query: dict, body: bytes):
+        numbers = [int(element.text) for element in ElementTree.fromstring(body).iter("PartNumber")]
+        with self.state.lock:
+            upload = self.state.uploads.pop(query["uploadId"], None)
+        if upload is None or any(number not in upload["parts"] for number in numbers):
+            return self.error(400, "InvalidPart")
+        parts = [upload["parts"][number] for number in numbers]
+        etag = f"{hashlib.md5(b''.join(part['digest'] for part in parts)).hexdigest()}-{len(parts)}"
+        self.store(key, etag, sum(part["size"] for part in parts), upload["headers"])
+        result = tag("Location", key) + tag("Bucket", "bench") + tag("Key", key) + tag("ETag", f'"{etag}"')
+        self.reply(200, xml("CompleteMultipartUploadResult", result), {"Content-Type": "application/xml"})
+
+
+def serve(state: CosState, port: int = 0) -> ThreadingHTTPServer:
+    handler = type("BoundCosHandler", (CosHandler,), {"state": state})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,186 @@
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class ScfState:
+    def __init__(self, latency: float = 0.0, throttle_rate: float = 0.0, transition_delay: float = 0.0):
+        self.lock = threading.Lock()
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.transition_delay = transition_delay
+        self.reset()
+
+    def reset(self, versions: int = 0):
+        with self.lock:
+            self.versions = {"$LATEST": {"ready": 0.0, "description": ""}}
+            for number in range(1, versions + 1):
+                self.versions[str(number)] = {"ready": 0.0, "description": ""}
+            self.next_version = versions + 1
+            self.aliases = {"$DEFAULT": {"version": "$LATEST", "weights": []}}
+            self.provisioned = {}
+            self.requests = 0
+            self.throttled = 0
+
+    def transition(self, qualifier: str, **fields):
+        # Versions report Updating/Publishing until the transition delay has passed.
+        self.versions[qualifier] = {**self.versions.get(qualifier, {}), **fields, "ready": time.monotonic() + self.transition_delay}
+
+
+class ApiError(Exception):
+    def __init__(self, code: str, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+class ScfHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: ScfState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, response: dict):
+        body = json.dumps({"Response": {**response, "RequestId": str(uuid.uuid4())}}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        params = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        action = self.headers.get("X-TC-Action", "")
+
+        # Simulate network latency and API rate limits.
+        state = self.state
+        if state.latency:
+            time.sleep(state.latency)
+        with state.lock:
+            state.requests += 1
+            throttled = random.random() < state.throttle_rate
+            state.throttled += throttled
+        if throttled:
+            return self.reply({"Error": {"Code": "RequestLimitExceeded", "Message": "Request rate limit exceeded."}})
+
+        handler = getattr(self, f"action_{action}", None)
+        if handler is None:
+            return self.reply({"Error": {"Code": "InvalidAction", "Message": f"Action {action} is not supported."}})
+        try:
+            with state.lock:
+                response = handler(params)
+        except ApiError as e:
+            response = {"Error": {"Code": e.code, "Message": str(e)}}
+        self.reply(response)
+
+    def version(self, qualifier: str) -> dict:
+        if qualifier not in self.state.versions:
+            raise ApiError("ResourceNotFound.Version", f"Version {qualifier} does not exist.")
+        return self.state.versions[qualifier]
+
+    def action_UpdateFunctionCode(self, params: dict) -> dict:
+        self.state.transition("$LATEST")
+        return {}
+
+    def action_GetFunction(self, params: dict) -> dict:
+        qualifier = params.get("Qualifier", "$LATEST")
+        version = self.version(qualifier)
+        updating = "Updating" if qualifier == "$LATEST" else "Publishing"
+        status = "Active" if time.monotonic() >= version["ready"] else updating
+        return {
+            "FunctionName": params["FunctionName"],
+            "Namespace": params.get("Namespace", "default"),
+            "Qualifier": qualifier,
+            "Description": version["description"],
+            "Status": status,
+            "StatusDesc": status,
+            "StatusReasons": [],
+        }
+
+    def action_PublishVersion(self, params: dict) -> dict:
+        if time.monotonic() < self.version("$LATEST")["ready"]:
+            raise ApiError("FailedOperation.PublishVersion", "Function $LATEST is still updating.")
+        qualifier = str(self.state.next_version)
+        self.state.next_version += 1
+        self.state.transition(qualifier, description=params.get("Description", ""))
+        return {"FunctionVersion": qualifier, "FunctionName": params["FunctionName"], "Namespace": params.get("Namespace", "default"), "Description": params.get("Description", "")}
+
+    def action_ListVersionByFunction(self, params: dict) -> dict:
+        offset, limit = params.get("Offset", 0), params.get("Limit", 20)
+        qualifiers = list(self.state.versions)
+        if params.get("Order") == "DESC":
+            qualifiers.reverse()
+        page = qualifiers[offset:offset + limit]
+        versions = [{"Version": q, "Description": self.state.versions[q]["description"], "Status": "Active"} for q in page]
+        return {"FunctionVersion": page, "Versions": versions, "TotalCount": len(qualifiers)}
+
+    def alias(self, name: str) -> dict:
+        alias = self.state.aliases.get(name, {"version": "$LATEST", "weights": []})
+        weights = [{"Version": version, "Weight": weight} for version, weight in alias["weights"]]
+        return {"Name": name, "FunctionVersion": alias["version"], "RoutingConfig": {"AdditionalVersionWeights": weights}}
+
+    def action_ListAliases(self, params: dict) -> dict:
+        offset, limit = params.get("Offset", 0), params.get("Limit", 20)
+        names = list(self.state.aliases)
+        return {"Aliases": [self.alias(name) for name in names[offset:offset + limit]], "TotalCount": len(names)}
+
+    def action_GetAlias(self, params: dict) -> dict:
+        if params["Name"] not in self.state.aliases:
+            raise ApiError("ResourceNotFound.Alias", f"Alias {params['Name']} does not exist.")
+        return self.alias(params["Name"])
+
+    def action_UpdateAlias(self, params: dict) -> dict:
+        self.version(params["FunctionVersion"])
+        weights = (params.get("RoutingConfig") or {}).get("AdditionalVersionWeights") or []
+        self.state.aliases[params["Name"]] = {
+            "version": params["FunctionVersion"],
+            "weights": [(weight["Version"], weight["Weight"]) for weight in weights],
+        }
+        return {}
+
+    def action_PutProvisionedConcurrencyConfig(self, params: dict) -> dict:
+        self.version(params["Qualifier"])
+        self.state.provisioned[params["Qualifier"]] = {
+            "number": params["VersionProvisionedConcurrencyNum"],
+            "ready": time.monotonic() + self.state.transition_delay,
+        }
+        return {}
+
+    def action_GetProvisionedConcurrencyConfig(self, params: dict) -> dict:
+        allocated = []
+        for qualifier, config in self.state.provisioned.items():
+            if params.get("Qualifier") not in (None, qualifier):
+                continue
+            done = time.monotonic() >= config["ready"]
+            allocated.append({
+                "Qualifier": qualifier,
+                "AllocatedProvisionedConcurrencyNum": config["number"],
+                "AvailableProvisionedConcurrencyNum": config["number"] if done else 0,
+                "Status": "Done" if done else "InProgress",
+                "StatusReason": "",
+            })
+        total = sum(config["number"] for config in self.state.provisioned.values())
+        return {"UnallocatedConcurrencyNum": 0, "Allocated": allocated, "TotalAllocatedConcurrencyNum": total}
+
+    def action_DeleteProvisionedConcurrencyConfig(self, params: dict) -> dict:
+        self.state.provisioned.pop(params["Qualifier"], None)
+        return {}
+
+    def action_DeleteFunction(self, params: dict) -> dict:
+        qualifier = params.get("Qualifier")
+        self.version(qualifier)
+        if any(alias["version"] == qualifier for alias in self.state.aliases.values()):
+            raise ApiError("FailedOperation.DeleteFunction", f"Version {qualifier} is referenced by an alias.")
+        del self.state.versions[qualifier]
+        return {}
+
+
+def serve(state: ScfState, port: int = 0) -> ThreadingHTTPServer:
+    handler = type("BoundScfHandler", (ScfHandler,), {"state": state})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
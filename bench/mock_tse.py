@@ -0,0 +1,108 @@
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class TseState:
+    def __init__(self, latency: float = 0.0):
+        self.lock = threading.Lock()
+        self.latency = latency
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.services = {}
+            self.history = []
+            self.requests = 0
+
+    def add_service(self, service_id: str, upstream_type: str, upstream_info: dict):
+        with self.lock:
+            self.services[service_id] = {"ID": service_id, "Name": service_id, "UpstreamType": upstream_type, "UpstreamInfo": upstream_info}
+
+
+class HealthState:
+    def __init__(self, fail_after: int | None = None):
+        # Targets answer 200 until fail_after probes were served, then 503.
+        self.lock = threading.Lock()
+        self.fail_after = fail_after
+        self.requests = 0
+
+
+class TseHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: TseState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, response: dict):
+        body = json.dumps({"Response": {**response, "RequestId": str(uuid.uuid4())}}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        params = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        action = self.headers.get("X-TC-Action", "")
+
+        state = self.state
+        if state.latency:
+            time.sleep(state.latency)
+        handler = getattr(self, f"action_{action}", None)
+        if handler is None:
+            return self.reply({"Error": {"Code": "InvalidAction", "Message": f"Action {action} is not supported."}})
+        with state.lock:
+            state.requests += 1
+            response = handler(params)
+        self.reply(response)
+
+    def action_DescribeCloudNativeAPIGatewayServices(self, params: dict) -> dict:
+        offset, limit = params.get("Offset", 0), params.get("Limit", 20)
+        services = list(self.state.services.values())
+        return {"Result": {"ServiceList": services[offset:offset + limit], "TotalCount": len(services)}}
+
+    def action_ModifyCloudNativeAPIGatewayService(self, params: dict) -> dict:
+        if params["ID"] not in self.state.services:
+            return {"Error": {"Code": "ResourceNotFound", "Message": f"Service {params['ID']} does not exist."}}
+        # Every modification is recorded, so tests can replay the weight steps.
+        self.state.services[params["ID"]].update(UpstreamType=params["UpstreamType"], UpstreamInfo=params["UpstreamInfo"])
+        self.state.history.append((params["UpstreamType"], params["UpstreamInfo"]))
+        return {}
+
+
+class HealthHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: HealthState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        with self.state.lock:
+            self.state.requests += 1
+            healthy = self.state.fail_after is None or self.state.requests <= self.state.fail_after
+        body = b"ok" if healthy else b"unhealthy"
+        self.send_response(200 if healthy else 503)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(state: TseState, port: int = 0) -> ThreadingHTTPServer:
+    handler = type("BoundTseHandler", (TseHandler,), {"state": state})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def serve_health(state: HealthState, port: int = 0) -> ThreadingHTTPServer:
+    handler = type("BoundHealthHandler", (HealthHandler,), {"state": state})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
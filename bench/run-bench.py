@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+import mock_cos
+import mock_scf
+
+
+###########################################################
+# Bench Config
+###########################################################
+BENCH_HOME = os.path.dirname(os.path.abspath(__file__))
+PIPELINE_HOME = os.path.join(os.path.dirname(BENCH_HOME), "pipeline")
+BENCH_BASELINE = os.path.join(BENCH_HOME, "baseline.json")
+BENCH_BLOCK_SIZE = 1024 * 1024
+
+# Synthetic trees as (file count, file size) groups, multiplied by --scale.
+BENCH_TREES = {
+    "small": [(2000, 4 * 1024)],
+    "huge": [(3, 96 * 1024 * 1024)],
+    "mixed": [(1000, 8 * 1024), (50, 2 * 1024 * 1024), (1, 96 * 1024 * 1024)],
+}
+BENCH_SCENARIOS = ["small", "small-resync", "huge", "mixed", "publish-zip", "publish-docker", "cleanup"]
+
+
+def write_tree(root: str, groups: list[tuple[int, int]], scale: float) -> tuple[int, int]:
+    # Files share one random block so large trees are cheap to generate but still differ by their first bytes.
+    block = os.urandom(BENCH_BLOCK_SIZE)
+    files = size = 0
+    for group, (count, file_size) in enumerate(groups):
+        for index in range(max(1, int(count * scale))):
+            path = os.path.join(root, f"group-{group}", f"{index // 100:03d}", f"file-{index}.bin")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(f"{group}-{index}\n".encode())
+                remaining = file_size
+                while remaining > 0:
+                    f.write(block[:remaining])
+                    remaining -= BENCH_BLOCK_SIZE
+            files += 1
+            size += os.path.getsize(path)
+    return files, size
+
+
+def write_package(path: str, size: int):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as package:
+        package.writestr("scf_bootstrap", "#!/bin/bash\nexec python3 index.py\n")
+        package.writestr("index.py", "def main_handler(event, context):\n    return event\n")
+        package.writestr("assets.bin", os.urandom(size))
+
+
+def run_script(script: str, argv: list[str], env: dict, cwd: str) -> str:
+    result = subprocess.run(
+        [sys.executable, os.path.join(PIPELINE_HOME, script), *argv],
+        env={**os.environ, **env}, cwd=cwd, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        sys.stderr.write(result.stdout[-4000:] + result.stderr[-4000:])
+        raise Exception(f"{script} exited with code {result.returncode}.")
+    return result.stdout
+
+
+def run_scenario(name: str, workdir: str, env: dict, cos: mock_cos.CosState, scf: mock_scf.ScfState, trees: dict, args) -> dict:
+    files = size = 0
+    if name in ("small", "small-resync", "huge", "mixed"):
+        # The resync scenario re-runs the sync of an unchanged tree.
+        tree = name.split("-")[0]
+        root = os.path.join(workdir, tree)
+        if tree not in trees:
+            trees[tree] = write_tree(root, BENCH_TREES[tree], args.scale)
+        files, size = trees[tree]
+        argv = [root, f"bench/{tree}", "--sync", "--manifest", os.path.join(workdir, f"{tree}.manifest.json")]
+        run = lambda: run_script("upload-cos.py", argv, env, workdir)
+    elif name == "publish-zip":
+        package = os.path.join(workdir, "package.zip")
+        write_package(package, int(4 * 1024 * 1024 * args.scale))
+        size = os.path.getsize(package)
+        run = lambda: run_script("publish-scf-zip.py", [package], env, workdir)
+    elif name == "publish-docker":
+        run = lambda: run_script("publish-scf-docker.py", ["ccr.ccs.tencentyun.com/bench/app", "latest"], env, workdir)
+    elif name == "cleanup":
+        files = max(1, int(args.versions * args.scale))
+        scf.reset(versions=files)
+        run = lambda: run_script("deploy-scf-version.py", [], {**env, "SCF_DEPLOY_VERSION": str(files)}, workdir)
+    else:
+        raise ValueError(f"Unknown scenario {name}.")
+
+    cos_requests, scf_requests = cos.requests, scf.requests
+    start = time.monotonic()
+    output = run()
+    seconds = time.monotonic() - start
+    result = {
+        "seconds": round(seconds, 3),
+        "cos_requests": cos.requests - cos_requests,
+        "scf_requests": scf.requests - scf_requests,
+    }
+    if files:
+        result["files"] = files
+        result["files_per_second"] = round(files / seconds, 1)
+    if size:
+        result["mb_per_second"] = round(size / seconds / 1024 / 1024, 2)
+    if name.startswith("publish"):
+        result["version"] = output.strip()
+    return result
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name, {}).get("seconds")
+        if expected and result["seconds"] > expected * (1 + tolerance):
+            regressions.append(f"{name}: {result['seconds']:.2f}s vs baseline {expected:.2f}s (+{result['seconds'] / expected - 1:.0%})")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline scripts against local COS and SCF stand-ins.")
+    parser.add_argument("--scenario", action="append", choices=BENCH_SCENARIOS, help="The scenarios to run, all by default.")
+    parser.add_argument("--scale", type=float, default=1.0, help="The multiplier of file counts, file sizes of packages and version counts.")
+    parser.add_argument("--versions", type=int, default=500, help="The number of existing versions the cleanup scenario starts with.")
+    parser.add_argument("--latency-ms", type=float, default=5, help="The latency (ms) added to every mock request.")
+    parser.add_argument("--bandwidth-mb", type=float, default=0, help="The upload bandwidth (MB/s) of each mock COS connection, unlimited by default.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="The fraction of mock requests rejected as throttled.")
+    parser.add_argument("--transition-delay", type=float, default=1.0, help="The seconds SCF versions and allocations take to become ready.")
+    parser.add_argument("--baseline", type=str, default=BENCH_BASELINE, help="The JSON file of baseline results to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="The allowed slowdown against the baseline before failing.")
+    parser.add_argument("--update-baseline", action="store_true", help="Store the results as the new baseline.")
+    args = parser.parse_args()
+
+    cos = mock_cos.CosState(args.latency_ms / 1000, args.throttle_rate, args.bandwidth_mb * 1024 * 1024)
+    scf = mock_scf.ScfState(args.latency_ms / 1000, args.throttle_rate, args.transition_delay)
+    cos_server, scf_server = mock_cos.serve(cos), mock_scf.serve(scf)
+    env = {
+        "TENCENT_CLOUD_SECRET_ID": "bench",
+        "TENCENT_CLOUD_SECRET_KEY": "bench",
+        "COS_REGION": "ap-guangzhou",
+        "COS_BUCKET": "bench-1250000000",
+        "COS_ENDPOINT": f"http://127.0.0.1:{cos_server.server_port}",
+        "SCF_REGION": "ap-guangzhou",
+        "SCF_NAMESPACE": "default",
+        "SCF_FUNCTION": "bench",
+        "SCF_ENDPOINT": f"http://127.0.0.1:{scf_server.server_port}",
+        "SCF_DEPLOY_VERSION": "1",
+    }
+
+    results = {}
+    trees = {}
+    with tempfile.TemporaryDirectory(prefix="pipeline-bench-") as workdir:
+        for name in args.scenario or BENCH_SCENARIOS:
+            print(f"[*] Running scenario {name}......", file=sys.stderr)
+            try:
+                results[name] = run_scenario(name, workdir, env, cos, scf, trees, args)
+            except Exception as e:
+                print(f"[!] Scenario {name} failed. Error: {e}", file=sys.stderr)
+                results[name] = {"error": str(e)}
+    print(json.dumps(results, indent=2))
+
+    if any("error" in result for result in results.values()):
+        sys.exit(1)
+    if args.update_baseline or not os.path.exists(args.baseline):
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"[*] Stored baseline '{args.baseline}'.", file=sys.stderr)
+        sys.exit(0)
+    with open(args.baseline, "r") as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    for regression in regressions:
+        print(f"[!] Regression in {regression}", file=sys.stderr)
+    if regressions:
+        sys.exit(1)
@@ -0,0 +1,131 @@
+import os
+import subprocess
+import sys
+import pytest
+import mock_tse
+
+pytest.importorskip("tencentcloud.tse")
+
+
+###########################################################
+# Test Config
+###########################################################
+BENCH_HOME = os.path.dirname(os.path.abspath(__file__))
+PIPELINE_HOME = os.path.join(os.path.dirname(BENCH_HOME), "pipeline")
+
+
+@pytest.fixture
+def tse():
+    state = mock_tse.TseState()
+    server = mock_tse.serve(state)
+    yield state, {
+        "TENCENT_CLOUD_SECRET_ID": "test",
+        "TENCENT_CLOUD_SECRET_KEY": "test",
+        "API_GATEWAY_REGION": "ap-guangzhou",
+        "API_GATEWAY_ID": "gateway-test",
+        "TSE_ENDPOINT": f"http://127.0.0.1:{server.server_port}",
+        "TSE_SHIFT_STEPS": "10,50",
+        "TSE_SHIFT_INTERVAL": "0",
+        "TSE_PROBE_INTERVAL": "0",
+        "TSE_PROBE_SAMPLES": "5",
+        "TSE_MAX_LATENCY_MS": "1000",
+        "TSE_LATENCY_SLACK_MS": "200",
+    }
+    server.shutdown()
+
+
+@pytest.fixture
+def upstreams():
+    servers = []
+
+    def start(fail_after: int | None = None) -> tuple[mock_tse.HealthState, int]:
+        state = mock_tse.HealthState(fail_after)
+        servers.append(mock_tse.serve_health(state))
+        return state, servers[-1].server_port
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def deploy(argv: list[str], env: dict) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, os.path.join(PIPELINE_HOME, "deploy-tse-api-gateway.py"),
+         "--id", "service-test", "--name", "test", "--protocol", "http", "--health-path", "/health", *argv],
+        env={**os.environ, **env}, capture_output=True, text=True, timeout=120,
+    )
+
+
+def weights(upstream_info: dict) -> dict[int, int]:
+    return {target["Port"]: target["Weight"] for target in upstream_info["Targets"]}
+
+
+def test_ip_list_shifts_in_steps(tse, upstreams):
+    state, env = tse
+    _, old_port = upstreams()
+    _, new_port = upstreams()
+    state.add_service("service-test", "IPList", {"Targets": [{"Host": "127.0.0.1", "Port": old_port, "Weight": 100}]})
+
+    result = deploy(["--type", "IPList", "--target", f"127.0.0.1:{new_port}"], env)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert [weights(info) for _, info in state.history] == [
+        {old_port: 900, new_port: 100},
+        {old_port: 500, new_port: 500},
+        {new_port: 100},
+    ]
+
+
+def test_ip_list_reverts_on_failed_probe(tse, upstreams):
+    state, env = tse
+    _, old_port = upstreams()
+    # The new target passes the probe before the switchover, then fails while holding the first step.
+    _, new_port = upstreams(fail_after=5)
+    previous = {"Targets": [{"Host": "127.0.0.1", "Port": old_port, "Weight": 100}]}
+    state.add_service("service-test", "IPList", previous)
+
+    result = deploy(["--type", "IPList", "--target", f"127.0.0.1:{new_port}"], env)
+    assert result.returncode == 1, result.stdout + result.stderr
+    assert "reverting to the previous upstream" in result.stdout
+    assert [weights(info) for _, info in state.history] == [{old_port: 900, new_port: 100}, {old_port: 100}]
+
+
+def test_split_keeps_small_upstreams_in_rotation(tse, upstreams):
+    state, env = tse
+    env = {**env, "TSE_SHIFT_STEPS": "99.96"}
+    _, old_port = upstreams()
+    _, new_port = upstreams()
+    state.add_service("service-test", "IPList", {"Targets": [{"Host": "127.0.0.1", "Port": old_port, "Weight": 100}]})
+
+    result = deploy(["--type", "IPList", "--target", f"127.0.0.1:{new_port}"], env)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert weights(state.history[0][1]) == {old_port: 1, new_port: 1000}
+
+
+def test_other_upstream_types_need_force(tse, upstreams):
+    state, env = tse
+    _, new_port = upstreams()
+    state.add_service("service-test", "Kubernetes", {"Namespace": "default", "ServiceName": "app"})
+
+    result = deploy(["--type", "IPList", "--target", f"127.0.0.1:{new_port}"], env)
+    assert result.returncode == 1
+    assert "use --force" in result.stdout
+    assert state.history == []
+
+    result = deploy(["--type", "IPList", "--target", f"127.0.0.1:{new_port}", "--force"], env)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert [weights(info) for _, info in state.history] == [{new_port: 100}]
+
+
+def test_udp_targets_need_force(tse, upstreams):
+    state, env = tse
+    # Nothing listens for TCP here, so any probe of the UDP target would fail.
+    _, old_port = upstreams()
+    state.add_service("service-test", "IPList", {"Targets": [{"Host": "127.0.0.1", "Port": old_port, "Weight": 100}]})
+
+    result = deploy(["--protocol", "udp", "--type", "IPList", "--target", "127.0.0.1:1"], env)
+    assert result.returncode == 1
+    assert "use --force" in result.stdout
+    assert state.history == []
+
+    result = deploy(["--protocol", "udp", "--type", "IPList", "--target", "127.0.0.1:1", "--force"], env)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert [weights(info) for _, info in state.history] == [{1: 100}]
@@ -0,0 +1,186 @@
+import argparse
+import gzip
+import os
+import runpy
+import subprocess
+import sys
+import time
+import pytest
+import mock_cos
+
+pytest.importorskip("qcloud_cos")
+
+
+###########################################################
+# Test Config
+###########################################################
+BENCH_HOME = os.path.dirname(os.path.abspath(__file__))
+PIPELINE_HOME = os.path.join(os.path.dirname(BENCH_HOME), "pipeline")
+
+
+@pytest.fixture
+def cos():
+    state = mock_cos.CosState()
+    server = mock_cos.serve(state)
+    yield state, {
+        "TENCENT_CLOUD_SECRET_ID": "test",
+        "TENCENT_CLOUD_SECRET_KEY": "test",
+        "COS_REGION": "ap-guangzhou",
+        "COS_BUCKET": "test-1250000000",
+        "COS_ENDPOINT": f"http://127.0.0.1:{server.server_port}",
+    }
+    server.shutdown()
+
+
+def upload_cos(argv: list[str], env: dict, cwd: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, os.path.join(PIPELINE_HOME, "upload-cos.py"), *argv],
+        env={**os.environ, **env}, cwd=cwd, capture_output=True, text=True, timeout=120,
+    )
+
+
+def load_upload_cos(env: dict, monkeypatch) -> dict:
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.syspath_prepend(PIPELINE_HOME)
+    # Clients are cached per process, so import common again to reach this test's mock.
+    monkeypatch.delitem(sys.modules, "common", raising=False)
+    return runpy.run_path(os.path.join(PIPELINE_HOME, "upload-cos.py"), run_name="upload_cos")
+
+
+def write_file(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def test_dedup_copies_compressed_duplicate(cos, tmp_path):
+    state, env = cos
+    script = b"console.log('hello');\n" * 200
+    write_file(os.path.join(tmp_path, "site", "a", "app.js"), script)
+    write_file(os.path.join(tmp_path, "site", "b", "app.js"), script)
+
+    result = upload_cos([str(tmp_path / "site"), "web", "--dedup", "--compress", "gzip"], env, str(tmp_path))
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "1 duplicates copied server-side" in result.stdout
+
+    # The copy carries its own headers, so both objects are served as compressed scripts.
+    for key in ("web/a/app.js", "web/b/app.js"):
+        obj = state.objects[key]
+        assert obj["headers"]["content-encoding"] == "gzip"
+        assert obj["headers"]["content-type"] in ("application/javascript", "text/javascript")
+        assert gzip.decompress(obj["body"]) == script
+
+
+def test_dedup_copies_duplicates_as_sources_land(cos, tmp_path):
+    state, env = cos
+    # A tiny queue forces uploaders to hand out waiting copies themselves.
+    for index in range(20):
+        write_file(os.path.join(tmp_path, "site", f"{index:02d}", "logo.png"), b"\x89PNG" + b"\0" * 4096)
+    write_file(os.path.join(tmp_path, "site", "index.html"), b"<html></html>")
+
+    result = upload_cos([str(tmp_path / "site"), "web", "--dedup", "--queue-size", "1", "--check-workers", "4"], env, str(tmp_path))
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "19 duplicates copied server-side" in result.stdout
+    # Uploads leave the type to COS, copies must set it since they replace the source headers.
+    types = [state.objects[f"web/{index:02d}/logo.png"]["headers"].get("content-type") for index in range(20)]
+    assert types.count("image/png") == 19
+
+
+def test_apply_policy_replaces_headers(cos, tmp_path):
+    state, env = cos
+    write_file(os.path.join(tmp_path, "site", "assets", "app.js"), b"console.log('hello');\n")
+    write_file(os.path.join(tmp_path, "policy.json"), b'{"rules": [{"match": "assets/*.js", "headers": {"Cache-Control": "max-age=31536000"}}]}')
+
+    result = upload_cos([str(tmp_path / "site" / "assets" / "app.js"), "assets/app.js", "--policy", "policy.json"], env, str(tmp_path))
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert state.objects["assets/app.js"]["headers"]["cache-control"] == "max-age=31536000"
+
+    write_file(os.path.join(tmp_path, "policy.json"), b'{"rules": [{"match": "assets/*.js", "headers": {"Cache-Control": "no-cache"}}]}')
+    result = upload_cos(["", "--apply-policy", "--policy", "policy.json"], env, str(tmp_path))
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "1 updated, 0 unchanged, 0 failed" in result.stdout
+    assert state.objects["assets/app.js"]["headers"]["cache-control"] == "no-cache"
+
+
+def test_sync_skips_unchanged_files_without_manifest(cos, tmp_path):
+    state, env = cos
+    # Files over 1MB but under the multipart threshold must land as one PUT, so their ETag is the MD5.
+    write_file(os.path.join(tmp_path, "site", "bundle.js"), os.urandom(2 * 1024 * 1024))
+
+    result = upload_cos([str(tmp_path / "site"), "web", "--manifest", "first.json"], env, str(tmp_path))
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "-" not in state.objects["web/bundle.js"]["etag"]
+
+    # A fresh runner has no manifest, so only the ETag can tell the file is unchanged.
+    result = upload_cos([str(tmp_path / "site"), "web", "--manifest", "second.json"], env, str(tmp_path))
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "0 uploaded, 1 skipped" in result.stdout
+
+
+def test_mixed_sizes_keep_concurrency(cos, tmp_path):
+    state, env = cos
+    state.latency, state.bandwidth = 0.005, 20 * 1024 * 1024
+    # Small files are all round trip, so they must not look congested next to the per-MB time of big ones.
+    for index in range(200):
+        write_file(os.path.join(tmp_path, "site", "small", f"{index}.txt"), os.urandom(2048))
+    for index in range(4):
+        write_file(os.path.join(tmp_path, "site", "big", f"{index}.bin"), os.urandom(2 * 1024 * 1024))
+
+    result = upload_cos([str(tmp_path / "site"), "web", "--upload-workers", "8", "--max-upload-workers", "8"], env, str(tmp_path))
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "concurrency 8 (peak 8), 0 throttled requests" in result.stdout
+
+
+def test_prune_releases_keeps_live_prefix(cos, tmp_path):
+    state, env = cos
+    prefixes = []
+    for version in range(4):
+        write_file(os.path.join(tmp_path, "site", "index.html"), f"<html>{version}</html>".encode())
+        result = upload_cos([str(tmp_path / "site"), "web/", "--release", "hash"], env, str(tmp_path))
+        assert result.returncode == 0, result.stdout + result.stderr
+        prefixes.append(result.stdout)
+    assert not any("//" in key for key in state.objects)
+
+    # Rolled back to the oldest release, which must survive pruning while the second one goes.
+    result = upload_cos(["web/", "--prune-releases", prefixes[0], "--keep-releases", "2"], env, str(tmp_path))
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert f"{prefixes[0].lstrip('/')}/index.html" in state.objects
+    assert f"{prefixes[1].lstrip('/')}/index.html" not in state.objects
+    assert all(f"{prefix.lstrip('/')}/index.html" in state.objects for prefix in prefixes[2:])
+
+
+def test_limiter_cuts_once_per_round_trip(cos, monkeypatch):
+    _, env = cos
+    module = load_upload_cos(env, monkeypatch)
+    clock = [0.0]
+    monkeypatch.setattr(time, "monotonic", lambda: clock[0])
+
+    limiter = module["AdaptiveLimiter"](32, 1, 32)
+    for seconds in [0.8] * 10 + [4.0] * 7:
+        # Slow 8MB transfers finish every 0.55s, all within one 4s round trip.
+        clock[0] += 0.55
+        limiter.acquire()
+        limiter.release(seconds, 8 * 1024 * 1024)
+    assert limiter.limit == 16
+
+
+def test_multipart_upload_never_completes_with_missing_parts(cos, tmp_path, monkeypatch):
+    state, env = cos
+    module = load_upload_cos(env, monkeypatch)
+    source = os.path.join(tmp_path, "big.bin")
+    write_file(source, os.urandom(3 * 1024 * 1024))
+    upload_part = module["upload_part"]
+
+    def failing_part(source, target, upload_id, number, offset, length):
+        # Errors outside the expected COS ones must not be swallowed by the part workers.
+        if number == 2:
+            raise RuntimeError("lost part")
+        return upload_part(source, target, upload_id, number, offset, length)
+
+    # Traced functions wrap the module ones, so patch through the globals of a plain helper.
+    monkeypatch.setitem(module["normalize_key"].__globals__, "upload_part", failing_part)
+    args = argparse.Namespace(part_size=1, part_workers=2, checkpoint_dir=str(tmp_path / "checkpoints"))
+    with pytest.raises(RuntimeError):
+        module["multipart_upload"](source, "web/big.bin", args, {})
+    assert "web/big.bin" not in state.objects
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import os
+import stat
+import struct
+import sys
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+###########################################################
+# Build Config
+###########################################################
+BUILD_CHUNK_SIZE = 1024 * 1024
+BUILD_WINDOW_SIZE = 32 * 1024
+# Every entry gets the earliest DOS timestamp (1980-01-01 00:00:00), so rebuilds are byte-identical.
+BUILD_DOS_DATE = (1 << 5) | 1
+BUILD_DOS_TIME = 0
+# Without zip64 records, sizes and offsets must stay below these values, which are reserved as zip64 markers.
+BUILD_MAX_SIZE = 0xFFFFFFFF
+BUILD_MAX_ENTRIES = 0xFFFF
+
+
+def collect_files(workspace: str, bootstrap: str | None, exclude: set[str]) -> list[tuple[str, str]]:
+    files = {}
+    for path, dirs, file_list in os.walk(workspace):
+        # Like 'zip -r package.zip *', hidden entries at the top level (.env, .git, .npmrc) are left out.
+        if path == workspace:
+            dirs[:] = [name for name in dirs if not name.startswith(".")]
+            file_list = [name for name in file_list if not name.startswith(".")]
+        dirs.sort()
+        for file_name in file_list:
+            source = os.path.join(path, file_name)
+            if os.path.abspath(source) not in exclude:
+                files[os.path.relpath(source, workspace).replace(os.sep, "/")] = source
+    if bootstrap:
+        files["scf_bootstrap"] = bootstrap
+    # Entries are sorted by name, so the archive does not depend on directory listing order.
+    return sorted(files.items())
+
+def compress_chunk(data: bytes, window: bytes, final: bool, level: int) -> bytes:
+    # Chunks continue one raw deflate stream: the previous window primes the dictionary and
+    # sync flushes end every chunk on a byte boundary, like pigz does.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=window) if window else zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+def compress_member(data: bytes, executor: ThreadPoolExecutor, level: int) -> bytes:
+    chunks = [data[offset:offset + BUILD_CHUNK_SIZE] for offset in range(0, len(data), BUILD_CHUNK_SIZE)] or [b""]
+    futures = [
+        executor.submit(compress_chunk, chunk, data[max(0, i * BUILD_CHUNK_SIZE - BUILD_WINDOW_SIZE):i * BUILD_CHUNK_SIZE], i == len(chunks) - 1, level)
+        for i, chunk in enumerate(chunks)
+    ]
+    return b"".join(future.result() for future in futures)
+
+def file_mode(source: str, name: str) -> int:
+    # Only the executable bit is kept from the workspace, the bootstrap is always executable.
+    executable = name == "scf_bootstrap" or os.stat(source).st_mode & stat.S_IXUSR
+    return stat.S_IFREG | (0o755 if executable else 0o644)
+
+def write_zip(output: str, files: list[tuple[str, str]], workers: int, level: int) -> str:
+    if len(files) >= BUILD_MAX_ENTRIES:
+        raise ValueError(f"Package has {len(files)} files, a ZIP without zip64 holds at most {BUILD_MAX_ENTRIES - 1}.")
+    sha256 = hashlib.sha256()
+    central = []
+    offset = 0
+    temp = f"{output}.tmp"
+    with open(temp, "wb") as f, ThreadPoolExecutor(max_workers=workers) as executor:
+        def write(data: bytes):
+            nonlocal offset
+            f.write(data)
+            sha256.update(data)
+            offset += len(data)
+
+        for name, source in files:
+            with open(source, "rb") as src:
+                data = src.read()
+            compressed = compress_member(data, executor, level)
+            method = 8
+            if len(compressed) >= len(data):
+                compressed, method = data, 0
+            if offset >= BUILD_MAX_SIZE or len(data) >= BUILD_MAX_SIZE or len(compressed) >= BUILD_MAX_SIZE:
+                raise ValueError(f"Package exceeds the 4GB limit of a ZIP without zip64 at '{name}'.")
+
+            encoded = name.encode("utf-8")
+            crc = zlib.crc32(data)
+            central.append((encoded, method, crc, len(compressed), len(data), file_mode(source, name), offset))
+            write(struct.pack(
+                "<IHHHHHIIIHH", 0x04034B50, 20, 0x800, method, BUILD_DOS_TIME, BUILD_DOS_DATE,
+                crc, len(compressed), len(data), len(encoded), 0,
+            ) + encoded)
+            write(compressed)
+
+        directory = offset
+        if directory >= BUILD_MAX_SIZE:
+            raise ValueError("Package exceeds the 4GB limit of a ZIP without zip64 at its central directory.")
+        for encoded, method, crc, compressed_size, size, mode, header_offset in central:
+            # Made by Unix (3), so unzip and SCF honour the permission bits.
+            write(struct.pack(
+                "<IHHHHHHIIIHHHHHII", 0x02014B50, (3 << 8) | 20, 20, 0x800, method, BUILD_DOS_TIME, BUILD_DOS_DATE,
+                crc, compressed_size, size, len(encoded), 0, 0, 0, 0, mode << 16, header_offset,
+            ) + encoded)
+        if offset - directory >= BUILD_MAX_SIZE:
+            raise ValueError("Central directory exceeds the 4GB limit of a ZIP without zip64.")
+        write(struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, len(central), len(central), offset - directory, directory, 0))
+    os.replace(temp, output)
+    return sha256.hexdigest()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a reproducible SCF ZIP package.")
+    parser.add_argument("workspace", help="The folder to package.", type=str)
+    parser.add_argument("--bootstrap", type=str, default="src/scf_bootstrap", help="The scf_bootstrap file added to the package root.")
+    parser.add_argument("--output", type=str, help="The path of the ZIP package, '<workspace>/package.zip' by default.")
+    parser.add_argument("--level", type=int, default=9, choices=range(0, 10), help="The deflate compression level.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="The number of threads compressing chunks of members.")
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(args.workspace, "package.zip")
+    bootstrap = args.bootstrap if os.path.isfile(args.bootstrap) else None
+    if bootstrap is None:
+        print(f"[!] Bootstrap '{args.bootstrap}' not found, packaging the workspace as is.", file=sys.stderr)
+
+    files = collect_files(args.workspace, bootstrap, {os.path.abspath(output), os.path.abspath(f"{output}.tmp")})
+    try:
+        digest = write_zip(output, files, args.workers, args.level)
+    except ValueError as e:
+        if os.path.exists(f"{output}.tmp"):
+            os.remove(f"{output}.tmp")
+        print(f"[!] {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"[*] Built '{output}' with {len(files)} files, SHA-256 {digest}.", file=sys.stderr)
+    print(output, end="", file=sys.stdout)
@@ -1,7 +1,5 @@
 #!/bin/bash
 WORKSPACE=$1
 
-cp src/scf_bootstrap $WORKSPACE
-pushd $WORKSPACE
-    zip -r package.zip *
-popd
\ No newline at end of file
+# Build a reproducible package: sorted entries, fixed timestamps, scf_bootstrap at the root.
+python3 "$(dirname "$0")/build-scf-zip.py" "$WORKSPACE" --bootstrap src/scf_bootstrap
\ No newline at end of file
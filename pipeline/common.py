@@ -0,0 +1,304 @@
+import atexit
+import contextlib
+import functools
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Callable
+
+
+###########################################################
+# Tracing
+###########################################################
+# Spans go to TRACE_FILE as JSON lines, and a per-operation latency summary is printed at exit.
+TRACE_FILE = os.environ.get("TRACE_FILE")
+TRACE_SUMMARY = os.environ.get("TRACE_SUMMARY", "true").lower() == "true"
+
+TRACE_LOCK = threading.Lock()
+TRACE_LOCAL = threading.local()
+TRACE_STATS = defaultdict(lambda: {"latencies": [], "errors": 0})
+TRACE_OUTPUT = None
+
+
+def write_trace(record: dict):
+    global TRACE_OUTPUT
+    if TRACE_OUTPUT is None:
+        TRACE_OUTPUT = open(TRACE_FILE, "a", buffering=1)
+    TRACE_OUTPUT.write(json.dumps(record, default=str) + "\n")
+
+
+def payload_size(value) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if hasattr(value, "to_json_string"):
+        return len(value.to_json_string())
+    if isinstance(value, dict):
+        if "Body" in value:
+            return payload_size(value["Body"])
+        if "LocalFilePath" in value:
+            return os.path.getsize(value["LocalFilePath"])
+        return int(value.get("Content-Length", 0))
+    return 0
+
+
+@contextlib.contextmanager
+def trace_span(operation: str):
+    span = {"request_bytes": 0, "response_bytes": 0}
+    start = time.monotonic()
+    outcome, error = "ok", None
+    try:
+        yield span
+    except BaseException as e:
+        outcome, error = "error", repr(e)
+        raise
+    finally:
+        latency = time.monotonic() - start
+        with TRACE_LOCK:
+            stats = TRACE_STATS[operation]
+            stats["latencies"].append(latency)
+            stats["errors"] += outcome != "ok"
+            if TRACE_FILE:
+                write_trace({
+                    "type": "span",
+                    "at": datetime.now(timezone.utc).isoformat(),
+                    "operation": operation,
+                    "latency_ms": round(latency * 1000, 3),
+                    "retries": getattr(TRACE_LOCAL, "retries", 0),
+                    "outcome": outcome,
+                    "error": error,
+                    **span,
+                })
+
+
+@contextlib.contextmanager
+def retry_attempt(attempt: int):
+    # Spans opened inside record which retry of a call they belong to.
+    TRACE_LOCAL.retries = attempt
+    try:
+        yield
+    finally:
+        TRACE_LOCAL.retries = 0
+
+
+def traced(operation: str):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with trace_span(operation):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TracedClient:
+    def __init__(self, client, service: str):
+        self._client = client
+        self._service = service
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._client, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            with trace_span(f"{self._service}.{name}") as span:
+                # Sizes cost a serialization, so only measure them when spans are written.
+                if TRACE_FILE:
+                    span["request_bytes"] = sum(payload_size(arg) for arg in args) + payload_size(kwargs)
+                result = attr(*args, **kwargs)
+                if TRACE_FILE:
+                    span["response_bytes"] = payload_size(result)
+                return result
+        return call
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+
+def trace_summary() -> dict[str, dict]:
+    with TRACE_LOCK:
+        return {
+            operation: {
+                "count": len(stats["latencies"]),
+                "errors": stats["errors"],
+                "p50_ms": round(percentile(stats["latencies"], 0.5) * 1000, 3),
+                "p95_ms": round(percentile(stats["latencies"], 0.95) * 1000, 3),
+                "total_ms": round(sum(stats["latencies"]) * 1000, 3),
+            }
+            for operation, stats in TRACE_STATS.items()
+        }
+
+
+@atexit.register
+def report_trace_summary():
+    summary = trace_summary()
+    if not summary:
+        return
+    if TRACE_FILE:
+        with TRACE_LOCK:
+            write_trace({"type": "summary", "operations": summary})
+    if TRACE_SUMMARY:
+        print("[*] Trace summary:", file=sys.stderr)
+        for operation, stats in sorted(summary.items(), key=lambda item: -item[1]["total_ms"]):
+            print(
+                f"    {operation}: {stats['count']} calls, {stats['errors']} errors, "
+                f"p50 {stats['p50_ms']:.1f}ms, p95 {stats['p95_ms']:.1f}ms, total {stats['total_ms']:.1f}ms",
+                file=sys.stderr,
+            )
+
+
+###########################################################
+# Response Logging
+###########################################################
+# Steps log the few fields they need, TENCENT_CLOUD_VERBOSE=true also dumps whole SDK responses.
+TENCENT_CLOUD_VERBOSE = os.environ.get("TENCENT_CLOUD_VERBOSE", "false").lower() == "true"
+
+
+def describe_response(resp) -> str:
+    return f"Response: {resp}" if TENCENT_CLOUD_VERBOSE else f"RequestId: {resp.RequestId}"
+
+
+###########################################################
+# Tencent Cloud Clients
+###########################################################
+# Clients are built on first use and cached per region, so steps running in one
+# process share their keep-alive HTTP sessions instead of opening new TLS connections.
+# {SERVICE}_ENDPOINT (e.g. SCF_ENDPOINT=http://127.0.0.1:9001) points a service at a local stand-in.
+# SDKs are imported on first use too, so COS-only steps run without the Tencent Cloud API SDK installed.
+TENCENT_CLOUD_REQUEST_TIMEOUT = int(os.environ.get("TENCENT_CLOUD_REQUEST_TIMEOUT", "60"))
+COS_POOL_SIZE = int(os.environ.get("COS_POOL_SIZE", "64"))
+
+
+@functools.lru_cache(maxsize=None)
+def get_credential():
+    from tencentcloud.common import credential
+    return credential.Credential(
+        os.environ["TENCENT_CLOUD_SECRET_ID"],
+        os.environ["TENCENT_CLOUD_SECRET_KEY"],
+    )
+
+
+def get_endpoint(service: str) -> tuple[str | None, str | None]:
+    endpoint = os.environ.get(f"{service.upper()}_ENDPOINT")
+    if not endpoint:
+        return None, None
+    protocol, _, host = endpoint.rpartition("://")
+    return protocol or None, host
+
+
+def get_client_profile(service: str):
+    from tencentcloud.common.profile.client_profile import ClientProfile
+    from tencentcloud.common.profile.http_profile import HttpProfile
+    protocol, endpoint = get_endpoint(service)
+    http_profile = HttpProfile(protocol=protocol, endpoint=endpoint, reqTimeout=TENCENT_CLOUD_REQUEST_TIMEOUT, keepAlive=True)
+    return ClientProfile(httpProfile=http_profile)
+
+
+@functools.lru_cache(maxsize=None)
+def get_scf_client(region: str):
+    from tencentcloud.scf.v20180416 import scf_client
+    return TracedClient(scf_client.ScfClient(get_credential(), region, get_client_profile("scf")), "scf")
+
+
+@functools.lru_cache(maxsize=None)
+def get_apigateway_client(region: str):
+    from tencentcloud.apigateway.v20180808 import apigateway_client
+    return TracedClient(apigateway_client.ApigatewayClient(get_credential(), region, get_client_profile("apigateway")), "apigateway")
+
+
+@functools.lru_cache(maxsize=None)
+def get_tse_client(region: str):
+    from tencentcloud.tse.v20201207 import tse_client
+    return TracedClient(tse_client.TseClient(get_credential(), region, get_client_profile("tse")), "tse")
+
+
+@functools.lru_cache(maxsize=None)
+def get_cos_client(region: str):
+    from qcloud_cos import CosConfig, CosS3Client
+    scheme, domain = get_endpoint("cos")
+    return TracedClient(CosS3Client(CosConfig(
+        Region=region,
+        SecretId=os.environ["TENCENT_CLOUD_SECRET_ID"],
+        SecretKey=os.environ["TENCENT_CLOUD_SECRET_KEY"],
+        Scheme=scheme,
+        Domain=domain,
+        PoolConnections=COS_POOL_SIZE,
+        PoolMaxSize=COS_POOL_SIZE,
+    )), "cos")
+
+
+###########################################################
+# Status Polling
+###########################################################
+SCF_FAILED_STATUSES = {"CreateFailed", "UpdateFailed", "PublishFailed", "DeleteFailed"}
+
+
+class WaitError(Exception):
+    def __init__(self, message: str, transitions: list[dict]):
+        super().__init__(message)
+        self.transitions = transitions
+
+
+def wait_until(
+    poll: Callable[[], tuple[str, str | None]],
+    status: str,
+    label: str,
+    timeout: float,
+    failed_statuses: set[str] = SCF_FAILED_STATUSES,
+    initial_delay: float = 0.5,
+    max_delay: float = 8.0,
+) -> list[dict]:
+    # Poll with exponential backoff and jitter, recording every status transition.
+    start = time.monotonic()
+    deadline = start + timeout
+    delay = initial_delay
+    transitions = []
+    while True:
+        current, reason = poll()
+        elapsed = time.monotonic() - start
+        if not transitions or transitions[-1]["status"] != current:
+            transitions.append({
+                "status": current,
+                "at": datetime.now(timezone.utc).isoformat(),
+                "elapsed": round(elapsed, 3),
+            })
+            print(f"[*] {label} is {current} after {elapsed:.1f}s.", file=sys.stderr)
+        if current == status:
+            return transitions
+        if current in failed_statuses:
+            raise WaitError(f"{label} failed with status {current}: {reason}", transitions)
+        if elapsed >= timeout:
+            raise WaitError(f"{label} is still {current} after {timeout}s, expected {status}.", transitions)
+        time.sleep(min(random.uniform(delay / 2, delay), max(deadline - time.monotonic(), 0)))
+        delay = min(delay * 2, max_delay)
+
+
+###########################################################
+# Throttling Retry
+###########################################################
+THROTTLING_ERROR_PREFIXES = ("RequestLimitExceeded",)
+
+
+def retry_throttled(call: Callable, retries: int = 5, base_delay: float = 0.5, max_delay: float = 8.0):
+    # Back off with full jitter when Tencent Cloud API rate limits kick in.
+    from tencentcloud.common.exception.tencent_cloud_sdk_exception import TencentCloudSDKException
+    for attempt in range(retries + 1):
+        try:
+            with retry_attempt(attempt):
+                return call()
+        except TencentCloudSDKException as e:
+            if attempt == retries or not (e.get_code() or "").startswith(THROTTLING_ERROR_PREFIXES):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            print(f"[!] Throttled ({e.get_code()}), retrying in {delay:.1f}s.", file=sys.stderr)
+            time.sleep(delay)
@@ -1,80 +1,210 @@
 #!/usr/bin/env python3
 import argparse
+import functools
+import json
 import os
 import sys
-from tencentcloud.common import credential
-from tencentcloud.apigateway.v20180808 import apigateway_client, models
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from tencentcloud.apigateway.v20180808 import models
+from tencentcloud.common.exception.tencent_cloud_sdk_exception import TencentCloudSDKException
+from common import describe_response, get_apigateway_client, retry_throttled, traced
 
 ###########################################################
 # API Gateway Config
 ###########################################################
 
 API_GATEWAY_REGION = os.environ["API_GATEWAY_REGION"]
-API_GATEWAY_SERVICE_ID = os.environ["API_GATEWAY_SERVICE_ID"]
-API_GATEWAY_API_ID = os.environ["API_GATEWAY_API_ID"]
+API_GATEWAY_SERVICE_ID = os.environ.get("API_GATEWAY_SERVICE_ID")
+API_GATEWAY_API_ID = os.environ.get("API_GATEWAY_API_ID")
+API_GATEWAY_ENVIRONMENT = os.environ.get("API_GATEWAY_ENVIRONMENT", "release")
+API_GATEWAY_WORKERS = int(os.environ.get("API_GATEWAY_WORKERS", "8"))
+API_GATEWAY_PAGE_SIZE = 100
+API_GATEWAY_SPEC_FIELDS = ("service_id", "api_id", "bucket", "path")
 
 ###########################################################
 # Setup Tencent Cloud Client
 ###########################################################
-TENCENT_CLOUD_SECRET_ID = os.environ["TENCENT_CLOUD_SECRET_ID"]
-TENCENT_CLOUD_SECRET_KEY = os.environ["TENCENT_CLOUD_SECRET_KEY"]
+TENCENT_API_GATEWAY_CLIENT = get_apigateway_client(API_GATEWAY_REGION)
 
-TENCENT_API_GATEWAY_CLIENT = apigateway_client.ApigatewayClient(
-    credential.Credential(
-        TENCENT_CLOUD_SECRET_ID,
-        TENCENT_CLOUD_SECRET_KEY,
-    ),
-    API_GATEWAY_REGION,
-)
 
+def describe_api(service_id: str, api_id: str) -> models.DescribeApiResponse:
+    request = models.DescribeApiRequest()
+    request.ServiceId = service_id
+    request.ApiId = api_id
+    return retry_throttled(lambda: TENCENT_API_GATEWAY_CLIENT.DescribeApi(request))
+
+def cos_backend(bucket: str, path: str) -> dict:
+    return {
+        "CosConfig": {
+            "Action": "GetObject",
+            "BucketName": bucket,
+            "Authorization": True,
+            "PathMatchMode": "FullPath",
+        },
+        "Path": path,
+    }
+
+def is_cos_backend_current(api: models.DescribeApiResponse, desired: dict) -> bool:
+    if api.Result.ServiceType != "COS" or api.Result.ServiceConfig is None:
+        return False
+    current = json.loads(api.Result.ServiceConfig.to_json_string())
+    return current.get("Path") == desired["Path"] and all(
+        (current.get("CosConfig") or {}).get(name) == value for name, value in desired["CosConfig"].items()
+    )
+
+def parse_time(value: str | None) -> datetime | None:
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00")) if value else None
+    except ValueError:
+        return None
+    # Compare everything as naive UTC, since the API returns both with and without offsets.
+    return parsed.astimezone(timezone.utc).replace(tzinfo=None) if parsed and parsed.tzinfo else parsed
+
+@functools.lru_cache(maxsize=None)
+def last_release_time(service_id: str) -> datetime | None:
+    latest = None
+    offset = 0
+    while True:
+        request = models.DescribeServiceEnvironmentReleaseHistoryRequest()
+        request.ServiceId = service_id
+        request.EnvironmentName = API_GATEWAY_ENVIRONMENT
+        request.Offset = offset
+        request.Limit = API_GATEWAY_PAGE_SIZE
+        result = retry_throttled(lambda: TENCENT_API_GATEWAY_CLIENT.DescribeServiceEnvironmentReleaseHistory(request)).Result
+        for version in result.VersionList or []:
+            released = parse_time(version.ReleaseTime)
+            if released is not None and (latest is None or released > latest):
+                latest = released
+        offset += len(result.VersionList or [])
+        if not result.VersionList or offset >= result.TotalCount:
+            return latest
+
+def is_released(api: models.DescribeApiResponse) -> bool:
+    # DescribeApi returns the draft, which is live only if the environment was released after its last change.
+    modified = parse_time(api.Result.ModifiedTime)
+    released = last_release_time(api.Result.ServiceId)
+    return modified is not None and released is not None and released >= modified
+
+@traced("update_cos_backend")
+def update_cos_backend(api: models.DescribeApiResponse, bucket: str, path: str) -> bool:
+    # Backends that are current and released need neither a modification nor a release.
+    desired = cos_backend(bucket, path)
+    if is_cos_backend_current(api, desired):
+        if is_released(api):
+            print(f"[*] API {api.Result.ApiId} already serves COS bucket {bucket} path {path}.")
+            return False
+        # E.g. an earlier run modified the API but its release failed.
+        print(f"[*] API {api.Result.ApiId} is set to COS bucket {bucket} path {path} but not released yet.")
+        return True
 
-def update_cos_backend(api: models.DescribeApiResponse, args: argparse.Namespace):
     request = models.ModifyApiRequest()
     request.from_json_string(api.Result.to_json_string())
     request.ServiceType = "COS"
     request.ServiceConfig = models.ServiceConfig()
-    request.ServiceConfig.from_json_string(
-        f"""
-        {{
-            "CosConfig": {{
-                "Action": "GetObject",
-                "BucketName": "{args.bucket}",
-                "Authorization": true,
-                "PathMatchMode": "FullPath"
-            }},
-            "Path": "{args.path}"
-        }}
-        """
-    )
-    response = TENCENT_API_GATEWAY_CLIENT.ModifyApi(request)
-    print(f"[*] Updated API Gateway Config: {response}")
+    request.ServiceConfig.from_json_string(json.dumps(desired))
+    response = retry_throttled(lambda: TENCENT_API_GATEWAY_CLIENT.ModifyApi(request))
+    print(f"[*] Updated API {api.Result.ApiId} to COS bucket {bucket} path {path}. {describe_response(response)}")
+    return True
+
+@traced("release_service")
+def release_service(service_id: str, description: str):
+    request = models.ReleaseServiceRequest()
+    request.ServiceId = service_id
+    request.EnvironmentName = API_GATEWAY_ENVIRONMENT
+    request.ReleaseDesc = description
+    response = retry_throttled(lambda: TENCENT_API_GATEWAY_CLIENT.ReleaseService(request))
+    print(f"[*] Released API Gateway service {service_id} to {API_GATEWAY_ENVIRONMENT}. {describe_response(response)}")
+
+def validate_spec(spec) -> list[str]:
+    apis = spec.get("apis") if isinstance(spec, dict) else None
+    if not isinstance(apis, list):
+        return ["Spec should be an object with an 'apis' list."]
+    errors = []
+    for i, api in enumerate(apis):
+        if not isinstance(api, dict):
+            errors.append(f"APIs entry #{i} should be an object.")
+            continue
+        missing = [name for name in API_GATEWAY_SPEC_FIELDS if not api.get(name)]
+        if missing:
+            errors.append(f"APIs entry #{i} ({api.get('api_id', 'no api_id')}) lacks {', '.join(missing)}.")
+    return errors
+
+@traced("deploy_spec")
+def deploy_spec(apis: list[dict]) -> int:
+    def update(api: dict) -> bool:
+        if api.get("type", "COS") != "COS":
+            raise ValueError(f"Unsupported backend type: {api['type']}")
+        current = describe_api(api["service_id"], api["api_id"])
+        return update_cos_backend(current, api["bucket"], api["path"])
+
+    # APIs are modified concurrently, then each affected service is released exactly once.
+    changed = defaultdict(list)
+    failed = defaultdict(list)
+    with ThreadPoolExecutor(max_workers=API_GATEWAY_WORKERS) as executor:
+        for api, future in [(api, executor.submit(update, api)) for api in apis]:
+            try:
+                if future.result():
+                    changed[api["service_id"]].append(api["api_id"])
+            except (TencentCloudSDKException, ValueError) as e:
+                print(f"[!] Failed to update API {api['api_id']} of service {api['service_id']}: {e}")
+                failed[api["service_id"]].append(api["api_id"])
+
+    # A service with a failed API is not released, so it never goes live half updated.
+    releases = {service_id: api_ids for service_id, api_ids in changed.items() if service_id not in failed}
+    for service_id in changed.keys() & failed.keys():
+        print(f"[!] Not releasing service {service_id}: APIs {failed[service_id]} failed, {changed[service_id]} modified.")
+    with ThreadPoolExecutor(max_workers=API_GATEWAY_WORKERS) as executor:
+        futures = {
+            service_id: executor.submit(release_service, service_id, f"Update APIs {', '.join(api_ids)}.")
+            for service_id, api_ids in releases.items()
+        }
+        for service_id, future in futures.items():
+            try:
+                future.result()
+            except TencentCloudSDKException as e:
+                print(f"[!] Failed to release service {service_id}: {e}")
+                failed[service_id].append("release")
+    print(f"[*] {sum(map(len, changed.values()))}/{len(apis)} APIs changed, {len(releases)} services released.")
+    return len(failed)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Deploy API Gateway")
-    parser.add_argument("--type", type=str, required=True, choices=["COS"], help="The type of API Gateway backend")
+    parser.add_argument("--type", type=str, choices=["COS"], help="The type of API Gateway backend")
+    parser.add_argument("--spec", type=str, help="The JSON file listing APIs across services and their desired backends.")
     group_cos = parser.add_argument_group("COS")
     group_cos.add_argument("--bucket", type=str, help="The bucket of COS")
     group_cos.add_argument("--path", type=str, help="The path of COS files")
     args = parser.parse_args()
 
+    if args.spec:
+        # Spec: {"apis": [{"service_id": ..., "api_id": ..., "type": "COS", "bucket": ..., "path": ...}]}
+        with open(args.spec, "r") as f:
+            spec = json.load(f)
+        errors = validate_spec(spec)
+        for error in errors:
+            print(f"[!] Invalid spec '{args.spec}': {error}")
+        if errors:
+            sys.exit(1)
+        if deploy_spec(spec["apis"]):
+            sys.exit(1)
+        sys.exit(0)
+    if args.type is None or not API_GATEWAY_SERVICE_ID or not API_GATEWAY_API_ID:
+        parser.error("--type with API_GATEWAY_SERVICE_ID and API_GATEWAY_API_ID, or --spec, is required.")
+
     # Read original API Gateway config.
-    request = models.DescribeApiRequest()
-    request.ServiceId = API_GATEWAY_SERVICE_ID
-    request.ApiId = API_GATEWAY_API_ID
-    api = TENCENT_API_GATEWAY_CLIENT.DescribeApi(request)
-    print(f"[*] Original API Gateway Config: {api}")
+    api = describe_api(API_GATEWAY_SERVICE_ID, API_GATEWAY_API_ID)
+    backend = api.Result.ServiceConfig.Path if api.Result.ServiceConfig else None
+    print(f"[*] Original API Gateway backend: {api.Result.ServiceType} {backend}. {describe_response(api)}")
 
     if args.type == "COS":
-        update_cos_backend(api, args)
+        changed = update_cos_backend(api, args.bucket, args.path)
     else:
         print(f"[*] Unsupported backend type: {args.type}")
         sys.exit(1)
-    
+
     # Release API Gateway update.
-    request = models.ReleaseServiceRequest()
-    request.ServiceId = API_GATEWAY_SERVICE_ID
-    request.EnvironmentName = "release"
-    request.ReleaseDesc = f"Update API {API_GATEWAY_API_ID} with arguments {args}."
-    response = TENCENT_API_GATEWAY_CLIENT.ReleaseService(request)
-    print(f"[*] Released API Gateway: {response}")
\ No newline at end of file
+    if changed:
+        release_service(API_GATEWAY_SERVICE_ID, f"Update API {API_GATEWAY_API_ID} with arguments {args}.")
@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 import base64
 import os
+import signal
 import time
-from tencentcloud.common import credential
-from tencentcloud.scf.v20180416 import scf_client, models
+from concurrent.futures import ThreadPoolExecutor
+from tencentcloud.common.exception.tencent_cloud_sdk_exception import TencentCloudSDKException
+from tencentcloud.scf.v20180416 import models
+from common import describe_response, get_scf_client, retry_throttled, traced, wait_until
 
 
 ###########################################################
@@ -17,22 +20,23 @@ SCF_DEPLOY_VERSION = os.environ["SCF_DEPLOY_VERSION"]
 
 SCF_ENABLE_CONCURRENCY = os.environ.get("SCF_ENABLE_CONCURRENCY", "false").lower() == "true"
 SCF_DEFAULT_CONCURRENCY = int(os.environ.get("SCF_DEFAULT_CONCURRENCY", "1"))
+SCF_WAIT_CONCURRENCY = os.environ.get("SCF_WAIT_CONCURRENCY", "true").lower() == "true"
+SCF_WAIT_TIMEOUT = float(os.environ.get("SCF_WAIT_TIMEOUT", "600"))
+
+SCF_ROLLOUT_STEPS = [float(step) for step in os.environ.get("SCF_ROLLOUT_STEPS", "").split(",") if step.strip()]
+SCF_ROLLOUT_INTERVAL = float(os.environ.get("SCF_ROLLOUT_INTERVAL", "60"))
+SCF_ROLLOUT_ABORT_FILE = os.environ.get("SCF_ROLLOUT_ABORT_FILE")
 
 SCF_ENABLE_CLEANUP = os.environ.get("SCF_ENABLE_CLEANUP", "true").lower() == "true"
+SCF_CLEANUP_WORKERS = int(os.environ.get("SCF_CLEANUP_WORKERS", "4"))
+SCF_KEEP_VERSIONS = int(os.environ.get("SCF_KEEP_VERSIONS", "0"))
+SCF_KEEP_ALIASED = os.environ.get("SCF_KEEP_ALIASED", "true").lower() == "true"
+SCF_PAGE_SIZE = 100
 
 ###########################################################
 # Setup Tencent Cloud Client
 ###########################################################
-TENCENT_CLOUD_SECRET_ID = os.environ["TENCENT_CLOUD_SECRET_ID"]
-TENCENT_CLOUD_SECRET_KEY = os.environ["TENCENT_CLOUD_SECRET_KEY"]
-
-TENCENT_SCF_CLIENT = scf_client.ScfClient(
-    credential.Credential(
-        TENCENT_CLOUD_SECRET_ID,
-        TENCENT_CLOUD_SECRET_KEY,
-    ),
-    SCF_REGION,
-)
+TENCENT_SCF_CLIENT = get_scf_client(SCF_REGION)
 
 
 def new_default_request(req):
@@ -40,6 +44,69 @@ def new_default_request(req):
     req.FunctionName = SCF_FUNCTION
     return req
 
+class RolloutAborted(Exception):
+    pass
+
+@traced("wait_provisioned_concurrency")
+def wait_provisioned_concurrency(version: str):
+    def poll():
+        req = new_default_request(models.GetProvisionedConcurrencyConfigRequest())
+        req.Qualifier = version
+        resp = TENCENT_SCF_CLIENT.GetProvisionedConcurrencyConfig(req)
+        for allocation in resp.Allocated or []:
+            if allocation.Qualifier != version:
+                continue
+            # Done only means the request settled, so also wait for the instances to be available.
+            if allocation.Status == "Done" and (allocation.AvailableProvisionedConcurrencyNum or 0) < SCF_DEFAULT_CONCURRENCY:
+                return "Warming", None
+            return allocation.Status, allocation.StatusReason
+        return "Pending", None
+
+    wait_until(poll, "Done", f"Provisioned concurrency of version {version}", SCF_WAIT_TIMEOUT, failed_statuses={"Failed"})
+
+def get_alias_version() -> str | None:
+    req = new_default_request(models.GetAliasRequest())
+    req.Name = SCF_DEPLOY_ALIAS
+    try:
+        return TENCENT_SCF_CLIENT.GetAlias(req).FunctionVersion
+    except TencentCloudSDKException as e:
+        print(f"[!] Failed to read alias {SCF_DEPLOY_ALIAS}: {e}")
+        return None
+
+def route_alias(version: str, canary: str | None = None, weight: float = 0):
+    # The primary version takes whatever traffic the additional version does not.
+    req = new_default_request(models.UpdateAliasRequest())
+    req.Name = SCF_DEPLOY_ALIAS
+    req.FunctionVersion = version
+    req.RoutingConfig = models.RoutingConfig()
+    req.RoutingConfig.AdditionalVersionWeights = []
+    if canary is not None:
+        version_weight = models.VersionWeight()
+        version_weight.Version = canary
+        version_weight.Weight = weight
+        req.RoutingConfig.AdditionalVersionWeights.append(version_weight)
+    resp = TENCENT_SCF_CLIENT.UpdateAlias(req)
+    split = f"{1 - weight:.0%} to {version}, {weight:.0%} to {canary}" if canary is not None else f"100% to {version}"
+    print(f"[*] Redirect {SCF_DEPLOY_ALIAS} traffic {split}. {describe_response(resp)}")
+
+def hold(seconds: float):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if SCF_ROLLOUT_ABORT_FILE and os.path.exists(SCF_ROLLOUT_ABORT_FILE):
+            raise RolloutAborted(f"Abort file {SCF_ROLLOUT_ABORT_FILE} found.")
+        time.sleep(min(1, max(deadline - time.monotonic(), 0)))
+
+def rollout(previous: str, version: str):
+    try:
+        for step in SCF_ROLLOUT_STEPS:
+            route_alias(previous, version, step / 100)
+            hold(SCF_ROLLOUT_INTERVAL)
+    except BaseException as e:
+        print(f"[!] Rollout of version {version} aborted, reverting {SCF_DEPLOY_ALIAS} to version {previous}: {e!r}")
+        route_alias(previous)
+        raise
+
+@traced("deploy")
 def deploy(version: str):
     # Allocate provisioned concurrency.
     if SCF_ENABLE_CONCURRENCY:
@@ -47,41 +114,105 @@ def deploy(version: str):
         req.Qualifier = version
         req.VersionProvisionedConcurrencyNum = SCF_DEFAULT_CONCURRENCY
         resp = TENCENT_SCF_CLIENT.PutProvisionedConcurrencyConfig(req)
-        print(f"[*] Updated provisioned concurrency: {resp}")
+        print(f"[*] Updated provisioned concurrency of version {version} to {SCF_DEFAULT_CONCURRENCY}. {describe_response(resp)}")
+
+        # Wait until warm instances are ready to take traffic.
+        if SCF_WAIT_CONCURRENCY:
+            wait_provisioned_concurrency(version)
+
+    # Shift alias traffic in weighted steps.
+    previous = get_alias_version() if SCF_ROLLOUT_STEPS else None
+    if previous and previous != version:
+        rollout(previous, version)
 
     # Redirect alias traffic.
-    req = new_default_request(models.UpdateAliasRequest())
-    req.Name = SCF_DEPLOY_ALIAS
-    req.FunctionVersion = version
-    resp = TENCENT_SCF_CLIENT.UpdateAlias(req)
-    print(f"[*] Redirect {SCF_DEPLOY_ALIAS} traffic: {resp}")
+    if previous:
+        route_alias(version)
+    else:
+        req = new_default_request(models.UpdateAliasRequest())
+        req.Name = SCF_DEPLOY_ALIAS
+        req.FunctionVersion = version
+        resp = TENCENT_SCF_CLIENT.UpdateAlias(req)
+        print(f"[*] Redirect {SCF_DEPLOY_ALIAS} traffic 100% to {version}. {describe_response(resp)}")
+
+def list_versions() -> list[str]:
+    versions = []
+    while True:
+        req = new_default_request(models.ListVersionByFunctionRequest())
+        req.Offset = len(versions)
+        req.Limit = SCF_PAGE_SIZE
+        resp = retry_throttled(lambda: TENCENT_SCF_CLIENT.ListVersionByFunction(req))
+        versions.extend(resp.FunctionVersion or [])
+        if not resp.FunctionVersion or len(versions) >= resp.TotalCount:
+            return versions
 
+def list_aliased_versions() -> set[str]:
+    versions = set()
+    offset = 0
+    while True:
+        req = new_default_request(models.ListAliasesRequest())
+        req.Offset = offset
+        req.Limit = SCF_PAGE_SIZE
+        resp = retry_throttled(lambda: TENCENT_SCF_CLIENT.ListAliases(req))
+        for alias in resp.Aliases or []:
+            versions.add(alias.FunctionVersion)
+            if alias.RoutingConfig:
+                versions.update(weight.Version for weight in alias.RoutingConfig.AdditionalVersionWeights or [])
+        offset += len(resp.Aliases or [])
+        if not resp.Aliases or offset >= resp.TotalCount:
+            return versions
+
+def delete_concurrently(items: list[str], delete) -> int:
+    def run(item: str) -> bool:
+        try:
+            retry_throttled(lambda: delete(item))
+            return True
+        except TencentCloudSDKException as e:
+            print(f"[!] Failed to delete {item}: {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=SCF_CLEANUP_WORKERS) as executor:
+        return sum(not ok for ok in executor.map(run, items))
+
+def delete_provisioned_concurrency(version: str):
+    req = new_default_request(models.DeleteProvisionedConcurrencyConfigRequest())
+    req.Qualifier = version
+    deleted = TENCENT_SCF_CLIENT.DeleteProvisionedConcurrencyConfig(req)
+    print(f"[*] Deleted outdated provisioned concurrency allocation for version {version}. {describe_response(deleted)}")
+
+def delete_version(version: str):
+    req = new_default_request(models.DeleteFunctionRequest())
+    req.Qualifier = version
+    deleted = TENCENT_SCF_CLIENT.DeleteFunction(req)
+    print(f"[*] Deleted outdated version {version}. {describe_response(deleted)}")
+
+@traced("cleanup")
 def cleanup(version: str):
     if not SCF_ENABLE_CLEANUP:
         return
 
+    # Versions still serving traffic through an alias keep their allocations.
+    aliased = list_aliased_versions() if SCF_KEEP_ALIASED else set()
+    versions = [v for v in list_versions() if v != "$LATEST"]
+    newest = sorted((v for v in versions if v.isdigit()), key=int, reverse=True)[:SCF_KEEP_VERSIONS]
+    keep = {version, *aliased, *newest}
+
     # Delete outdated provisioned concurrency allocations.
     req = new_default_request(models.GetProvisionedConcurrencyConfigRequest())
-    provision = TENCENT_SCF_CLIENT.GetProvisionedConcurrencyConfig(req)
-    for allocation in provision.Allocated:
-        if allocation.Qualifier == version:
-            continue
-        req = new_default_request(models.DeleteProvisionedConcurrencyConfigRequest())
-        req.Qualifier = allocation.Qualifier
-        deleted = TENCENT_SCF_CLIENT.DeleteProvisionedConcurrencyConfig(req)
-        print(f"[*] Deleted outdated provisioned concurrency allocation for version {allocation.Qualifier}: {deleted}")
+    provision = retry_throttled(lambda: TENCENT_SCF_CLIENT.GetProvisionedConcurrencyConfig(req))
+    outdated = [a.Qualifier for a in provision.Allocated or [] if a.Qualifier != version and a.Qualifier not in aliased]
+    failed = delete_concurrently(outdated, delete_provisioned_concurrency)
 
     # Delete outdated versions.
-    req = new_default_request(models.ListVersionByFunctionRequest())
-    versions = TENCENT_SCF_CLIENT.ListVersionByFunction(req)
-    for v in versions.FunctionVersion:
-        if v == "$LATEST" or v == version:
-            continue
-        req = new_default_request(models.DeleteFunctionRequest())
-        req.Qualifier = v
-        deleted = TENCENT_SCF_CLIENT.DeleteFunction(req)
-        print(f"[*] Deleted outdated version {v}: {deleted}")
+    failed += delete_concurrently([v for v in versions if v not in keep], delete_version)
+    print(f"[*] Kept versions {sorted(keep)}.")
+    if failed:
+        raise Exception(f"Failed to delete {failed} outdated versions or allocations.")
+
+def abort_on_sigterm(signum, frame):
+    raise RolloutAborted(f"Received signal {signum}.")
 
 if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, abort_on_sigterm)
     deploy(SCF_DEPLOY_VERSION)
     cleanup(SCF_DEPLOY_VERSION)
\ No newline at end of file
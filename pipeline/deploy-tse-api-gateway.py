@@ -1,29 +1,199 @@
 #!/usr/bin/env python3
 import argparse
+import http.client
 import os
+import socket
+import ssl
 import sys
-from tencentcloud.common import credential
-from tencentcloud.tse.v20201207 import tse_client, models
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tencentcloud.tse.v20201207 import models
+from common import describe_response, get_tse_client, retry_throttled, traced
 
 ###########################################################
 # API Gateway Config
 ###########################################################
 API_GATEWAY_REGION = os.environ["API_GATEWAY_REGION"]
 API_GATEWAY_ID = os.environ["API_GATEWAY_ID"]
+API_GATEWAY_PAGE_SIZE = 100
+
+# IPList upstreams take traffic in weighted steps (percent), gated by probes of the new targets.
+TSE_SHIFT_STEPS = [float(step) for step in os.environ.get("TSE_SHIFT_STEPS", "10,25,50").split(",") if step.strip()]
+TSE_SHIFT_INTERVAL = float(os.environ.get("TSE_SHIFT_INTERVAL", "30"))
+TSE_PROBE_INTERVAL = float(os.environ.get("TSE_PROBE_INTERVAL", "5"))
+TSE_PROBE_SAMPLES = int(os.environ.get("TSE_PROBE_SAMPLES", "5"))
+TSE_PROBE_TIMEOUT = float(os.environ.get("TSE_PROBE_TIMEOUT", "5"))
+TSE_MAX_ERROR_RATE = float(os.environ.get("TSE_MAX_ERROR_RATE", "0.05"))
+TSE_MAX_LATENCY_MS = float(os.environ.get("TSE_MAX_LATENCY_MS", "1000"))
+TSE_LATENCY_TOLERANCE = float(os.environ.get("TSE_LATENCY_TOLERANCE", "2.0"))
+TSE_LATENCY_SLACK_MS = float(os.environ.get("TSE_LATENCY_SLACK_MS", "20"))
+TSE_TOTAL_WEIGHT = 1000
+TSE_WEIGHTED_TYPES = ("HostIP", "IPList")
 
 ###########################################################
 # Setup Tencent Cloud Client
 ###########################################################
-TENCENT_CLOUD_SECRET_ID = os.environ["TENCENT_CLOUD_SECRET_ID"]
-TENCENT_CLOUD_SECRET_KEY = os.environ["TENCENT_CLOUD_SECRET_KEY"]
+TENCENT_API_GATEWAY_CLIENT = get_tse_client(API_GATEWAY_REGION)
+
+
+class UpstreamDegraded(Exception):
+    pass
+
+def parse_target(value: str) -> tuple[str, int, int]:
+    # Targets look like host:port or host:port:weight.
+    parts = value.rsplit(":", 2) if value.count(":") >= 2 else value.rsplit(":", 1)
+    if len(parts) < 2:
+        raise argparse.ArgumentTypeError(f"Target '{value}' should be host:port[:weight].")
+    return parts[0], int(parts[1]), int(parts[2]) if len(parts) == 3 else 100
+
+def describe_service(service_id: str):
+    offset = 0
+    while True:
+        request = models.DescribeCloudNativeAPIGatewayServicesRequest()
+        request.GatewayId = API_GATEWAY_ID
+        request.Offset = offset
+        request.Limit = API_GATEWAY_PAGE_SIZE
+        result = retry_throttled(lambda: TENCENT_API_GATEWAY_CLIENT.DescribeCloudNativeAPIGatewayServices(request)).Result
+        for service in result.ServiceList or []:
+            if service.ID == service_id:
+                return service
+        offset += len(result.ServiceList or [])
+        if not result.ServiceList or offset >= result.TotalCount:
+            return None
+
+def current_targets(service) -> list[tuple[str, int, int]]:
+    if service is None or service.UpstreamInfo is None:
+        return []
+    if service.UpstreamType == "HostIP":
+        return [(service.UpstreamInfo.Host, service.UpstreamInfo.Port, 100)]
+    if service.UpstreamType == "IPList":
+        return [(target.Host, target.Port, target.Weight) for target in service.UpstreamInfo.Targets or [] if target.Weight]
+    return []
+
+def modify_service(args: argparse.Namespace, upstream_type: str, upstream_info):
+    request = models.ModifyCloudNativeAPIGatewayServiceRequest()
+    request.GatewayId = API_GATEWAY_ID
+    request.ID = args.id
+    request.Name = args.name
+    request.Protocol = args.protocol
+    request.Path = args.path
+    request.Timeout = args.timeout
+    request.Retries = args.retries
+    request.UpstreamType = upstream_type
+    request.UpstreamInfo = upstream_info
+    return retry_throttled(lambda: TENCENT_API_GATEWAY_CLIENT.ModifyCloudNativeAPIGatewayService(request))
+
+def ip_list(weighted: list[tuple[str, int, int]]):
+    upstream_info = models.KongUpstreamInfo()
+    upstream_info.Targets = []
+    for host, port, weight in weighted:
+        target = models.KongTarget()
+        target.Host = host
+        target.Port = port
+        target.Weight = weight
+        upstream_info.Targets.append(target)
+    return upstream_info
+
+def split_weights(old: list[tuple[str, int, int]], new: list[tuple[str, int, int]], percent: float) -> list[tuple[str, int, int]]:
+    # Each side keeps its relative weights while the sides split the total by percent.
+    # No target drops to weight 0 before the final switch, which would take it out of rotation early.
+    def scale(targets, share):
+        total = sum(weight for _, _, weight in targets)
+        return [(host, port, max(1, round(weight / total * share * TSE_TOTAL_WEIGHT))) for host, port, weight in targets]
+    return scale(old, 1 - percent / 100) + scale(new, percent / 100)
 
-TENCENT_API_GATEWAY_CLIENT = tse_client.TseClient(
-    credential.Credential(
-        TENCENT_CLOUD_SECRET_ID,
-        TENCENT_CLOUD_SECRET_KEY,
-    ),
-    API_GATEWAY_REGION,
-)
+def probe_target(host: str, port: int, protocol: str, path: str) -> tuple[bool, float]:
+    start = time.monotonic()
+    try:
+        if protocol in ("http", "https"):
+            if protocol == "https":
+                # Targets are usually addressed by IP, so their certificates cannot be verified here.
+                context = ssl.create_default_context()
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+                connection = http.client.HTTPSConnection(host, port, timeout=TSE_PROBE_TIMEOUT, context=context)
+            else:
+                connection = http.client.HTTPConnection(host, port, timeout=TSE_PROBE_TIMEOUT)
+            try:
+                connection.request("GET", path)
+                healthy = connection.getresponse().status < 500
+            finally:
+                connection.close()
+        else:
+            socket.create_connection((host, port), timeout=TSE_PROBE_TIMEOUT).close()
+            healthy = True
+    except (OSError, http.client.HTTPException):
+        healthy = False
+    return healthy, time.monotonic() - start
+
+@traced("probe_targets")
+def probe_targets(targets: list[tuple[str, int, int]], args: argparse.Namespace) -> dict:
+    samples = [(host, port) for host, port, _ in targets for _ in range(TSE_PROBE_SAMPLES)]
+    with ThreadPoolExecutor(max_workers=min(len(samples), 16)) as executor:
+        results = list(executor.map(lambda target: probe_target(*target, args.protocol, args.health_path), samples))
+    latencies = sorted(seconds * 1000 for healthy, seconds in results if healthy)
+    return {
+        "error_rate": sum(not healthy for healthy, _ in results) / len(results),
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+    }
+
+def check_health(label: str, probe: dict, baseline: dict | None):
+    limit = TSE_MAX_LATENCY_MS
+    if baseline and baseline["p95_ms"] is not None:
+        # The slack keeps sub-millisecond baselines on local links from flagging every jitter.
+        limit = min(limit, max(baseline["p95_ms"] * TSE_LATENCY_TOLERANCE, baseline["p95_ms"] + TSE_LATENCY_SLACK_MS))
+    latency = f"{probe['p95_ms']:.1f}ms" if probe["p95_ms"] is not None else "n/a"
+    print(f"[*] {label}: error rate {probe['error_rate']:.1%}, p95 latency {latency} (limit {limit:.1f}ms).")
+    if probe["error_rate"] > TSE_MAX_ERROR_RATE:
+        raise UpstreamDegraded(f"{label} error rate {probe['error_rate']:.1%} exceeds {TSE_MAX_ERROR_RATE:.1%}.")
+    if probe["p95_ms"] is None or probe["p95_ms"] > limit:
+        raise UpstreamDegraded(f"{label} p95 latency {latency} exceeds {limit:.1f}ms.")
+
+def hold(seconds: float, targets: list[tuple[str, int, int]], baseline: dict | None, args: argparse.Namespace):
+    deadline = time.monotonic() + seconds
+    while True:
+        check_health("New targets", probe_targets(targets, args), baseline)
+        if time.monotonic() >= deadline:
+            return
+        time.sleep(min(TSE_PROBE_INTERVAL, max(deadline - time.monotonic(), 0)))
+
+@traced("switch_ip_list")
+def switch_ip_list(args: argparse.Namespace):
+    service = describe_service(args.id)
+    if service is not None and service.UpstreamType not in TSE_WEIGHTED_TYPES:
+        if not args.force:
+            print(f"[!] Upstream type {service.UpstreamType} cannot shift traffic in steps, use --force to switch it at once.")
+            sys.exit(1)
+        print(f"[!] Upstream type {service.UpstreamType} cannot shift traffic in steps, switching it at once.")
+    # Probes connect over TCP, which UDP-only targets refuse, so their steps could never pass.
+    probed = args.protocol != "udp"
+    if not probed:
+        if not args.force:
+            print("[!] UDP targets cannot be probed, use --force to switch them at once without health checks.")
+            sys.exit(1)
+        print("[!] UDP targets cannot be probed, switching them at once without health checks.")
+    old = [target for target in current_targets(service) if target[:2] not in {new[:2] for new in args.target}]
+    if not old and probed:
+        print("[*] No other targets serve traffic, switching to the new targets at once.")
+
+    # Probe new targets before they take any traffic, against the old ones as a latency baseline.
+    baseline = probe_targets(old, args) if old and probed else None
+    if probed:
+        check_health("New targets before switchover", probe_targets(args.target, args), baseline)
+
+    try:
+        for step in TSE_SHIFT_STEPS if old and probed else []:
+            response = modify_service(args, "IPList", ip_list(split_weights(old, args.target, step)))
+            print(f"[*] Shifted {step:.0f}% of traffic to new targets. {describe_response(response)}")
+            hold(TSE_SHIFT_INTERVAL, args.target, baseline, args)
+        response = modify_service(args, "IPList", ip_list(args.target))
+        print(f"[*] Released API Gateway service {args.id} to {len(args.target)} targets. {describe_response(response)}")
+    except BaseException as e:
+        if service is None:
+            raise
+        print(f"[!] Switchover aborted, reverting to the previous upstream: {e!r}")
+        modify_service(args, service.UpstreamType, service.UpstreamInfo)
+        raise
 
 
 if __name__ == "__main__":
@@ -39,26 +209,27 @@ if __name__ == "__main__":
     group_hostip = parser.add_argument_group("HostIP")
     group_hostip.add_argument("--host", type=str, help="The IP or host of upstream server.")
     group_hostip.add_argument("--port", type=int, help="The port of upstream server.")
+    group_iplist = parser.add_argument_group("IPList")
+    group_iplist.add_argument("--target", type=parse_target, action="append", default=[], help="The host:port[:weight] of an upstream server, repeatable.")
+    group_iplist.add_argument("--health-path", type=str, default="/", help="The path probed on new upstream servers before and while they take traffic.")
+    group_iplist.add_argument("--force", action="store_true", help="Switch upstreams of other types than HostIP or IPList, or UDP targets, at once without weighted steps.")
     args = parser.parse_args()
 
-    # Update API Gateway service.
-    request = models.ModifyCloudNativeAPIGatewayServiceRequest()
-    request.GatewayId = API_GATEWAY_ID
-    request.ID = args.id
-    request.Name = args.name
-    request.Protocol = args.protocol
-    request.Path = args.path
-    request.Timeout = args.timeout
-    request.Retries = args.retries
-
-    request.UpstreamType = args.type
-    request.UpstreamInfo = models.KongUpstreamInfo()
     if args.type == "HostIP":
-        request.UpstreamInfo.Host = args.host
-        request.UpstreamInfo.Port = args.port
+        # Update API Gateway service.
+        upstream_info = models.KongUpstreamInfo()
+        upstream_info.Host = args.host
+        upstream_info.Port = args.port
+        response = modify_service(args, "HostIP", upstream_info)
+        print(f"[*] Released API Gateway service {args.id} to {args.host}:{args.port}. {describe_response(response)}")
+    elif args.type == "IPList":
+        if not args.target:
+            parser.error("--type IPList requires at least one --target.")
+        try:
+            switch_ip_list(args)
+        except UpstreamDegraded as e:
+            print(f"[!] {e}")
+            sys.exit(1)
     else:
         # TODO: Support more upstream types.
         raise Exception("Unsupported upstream type.")
-
-    response = TENCENT_API_GATEWAY_CLIENT.ModifyCloudNativeAPIGatewayService(request)
-    print(f"[*] Released API Gateway: {response}")
\ No newline at end of file
@@ -2,9 +2,8 @@
 import argparse
 import os
 import sys
-import time
-from tencentcloud.common import credential
-from tencentcloud.scf.v20180416 import scf_client, models
+from tencentcloud.scf.v20180416 import models
+from common import describe_response, get_scf_client, traced, wait_until as poll_until
 
 
 ###########################################################
@@ -13,20 +12,12 @@ from tencentcloud.scf.v20180416 import scf_client, models
 SCF_REGION = os.environ["SCF_REGION"]
 SCF_NAMESPACE = os.environ["SCF_NAMESPACE"]
 SCF_FUNCTION = os.environ["SCF_FUNCTION"]
+SCF_WAIT_TIMEOUT = float(os.environ.get("SCF_WAIT_TIMEOUT", "600"))
 
 ###########################################################
 # Setup Tencent Cloud Client
 ###########################################################
-TENCENT_CLOUD_SECRET_ID = os.environ["TENCENT_CLOUD_SECRET_ID"]
-TENCENT_CLOUD_SECRET_KEY = os.environ["TENCENT_CLOUD_SECRET_KEY"]
-
-TENCENT_SCF_CLIENT = scf_client.ScfClient(
-    credential.Credential(
-        TENCENT_CLOUD_SECRET_ID,
-        TENCENT_CLOUD_SECRET_KEY,
-    ),
-    SCF_REGION,
-)
+TENCENT_SCF_CLIENT = get_scf_client(SCF_REGION)
 
 
 def new_default_request(req):
@@ -34,16 +25,18 @@ def new_default_request(req):
     req.FunctionName = SCF_FUNCTION
     return req
 
-def wait_until(version: str, status: str):
-    while True:
+def wait_until(version: str, status: str) -> list[dict]:
+    def poll():
         req = new_default_request(models.GetFunctionRequest())
         req.Qualifier = version
         req.ShowCode = "FALSE"
         resp = TENCENT_SCF_CLIENT.GetFunction(req)
-        if resp.Status == status:
-            return
-        time.sleep(1)
+        reasons = "; ".join(f"{r.ErrorCode}: {r.ErrorMessage}" for r in resp.StatusReasons or [])
+        return resp.Status, reasons or resp.StatusDesc
+
+    return poll_until(poll, status, f"SCF function {SCF_FUNCTION} version {version}", SCF_WAIT_TIMEOUT)
 
+@traced("publish")
 def publish(image_repo: str, image_tag: str) -> str:
     # Update $LATEST codes.
     req = new_default_request(models.UpdateFunctionCodeRequest())
@@ -52,7 +45,7 @@ def publish(image_repo: str, image_tag: str) -> str:
     req.Code.ImageConfig.ImageType = "personal"
     req.Code.ImageConfig.ImageUri = f"{image_repo}:{image_tag}"
     resp = TENCENT_SCF_CLIENT.UpdateFunctionCode(req)
-    print(f"[*] Updated SCF function {SCF_FUNCTION} with image {image_repo}:{image_tag}. Response: {resp}", file=sys.stderr)
+    print(f"[*] Updated SCF function {SCF_FUNCTION} with image {image_repo}:{image_tag}. {describe_response(resp)}", file=sys.stderr)
 
     # Wait until $LATEST version online.
     wait_until("$LATEST", "Active")
@@ -60,7 +53,7 @@ def publish(image_repo: str, image_tag: str) -> str:
     # Publish $LATEST version.
     req = new_default_request(models.PublishVersionRequest())
     resp = TENCENT_SCF_CLIENT.PublishVersion(req)
-    print(f"[*] Published SCF version: {resp.FunctionVersion}. Response: {resp}", file=sys.stderr)
+    print(f"[*] Published SCF version: {resp.FunctionVersion}. {describe_response(resp)}", file=sys.stderr)
 
     # Wait until published version online.
     wait_until(resp.FunctionVersion, "Active")
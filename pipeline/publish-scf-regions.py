@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import io
+import json
+import os
+import runpy
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+###########################################################
+# Fan-out Config
+###########################################################
+PIPELINE_HOME = os.path.dirname(os.path.abspath(__file__))
+SCF_REGIONS = [region.strip() for region in os.environ.get("SCF_REGIONS", "").split(",") if region.strip()]
+
+
+class RegionStream(io.TextIOBase):
+    # Worker threads log concurrently, so every line is tagged with the region it belongs to.
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def write(self, text: str) -> int:
+        region = getattr(self.local, "region", None)
+        buffer = getattr(self.local, "buffer", "") + text
+        *lines, self.local.buffer = buffer.split("\n")
+        with self.lock:
+            for line in lines:
+                self.stream.write(f"[{region}] {line}\n" if region else f"{line}\n")
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    @contextlib.contextmanager
+    def inherited(self):
+        # Scripts log from their own worker threads too, so new threads take the region of the thread starting them.
+        start = threading.Thread.start
+        local = self.local
+
+        def start_in_region(thread: threading.Thread):
+            region, run = getattr(local, "region", None), thread.run
+
+            def run_in_region():
+                local.region = region
+                run()
+            thread.run = run_in_region
+            start(thread)
+
+        threading.Thread.start = start_in_region
+        try:
+            yield
+        finally:
+            threading.Thread.start = start
+
+
+def load_region(region: str, script: str) -> dict:
+    # Scripts bind their region at import time, so each region gets its own copy of the module.
+    saved_env = dict(os.environ)
+    os.environ["SCF_REGION"] = region
+    os.environ.setdefault("SCF_DEPLOY_VERSION", "$LATEST")
+    try:
+        return runpy.run_path(os.path.join(PIPELINE_HOME, script), run_name=f"{script}:{region}")
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_env)
+
+
+def publish_zip(module: dict, region: str, args: argparse.Namespace, description: str, code: dict | None) -> tuple[str, bool]:
+    latest = None if args.force else module["latest_published_version"]()
+    if latest is not None and latest[1] == description:
+        print(f"[*] SCF version {latest[0]} already has package {description}, skipping publish.")
+        return latest[0], True
+    if code is None:
+        code = module["stage_package"](args.file, args.cos_bucket.format(region=region), region)
+    return module["publish"](code, description), False
+
+
+def release_region(region: str, args: argparse.Namespace, stream: RegionStream, shared: dict) -> dict:
+    stream.local.region = region
+    result = {"region": region, "version": None, "timings": {}}
+    start = time.monotonic()
+    try:
+        step = time.monotonic()
+        if args.mode == "zip":
+            result["version"], result["skipped"] = publish_zip(shared["publish"][region], region, args, shared["description"], shared["code"])
+        else:
+            result["version"] = shared["publish"][region]["publish"](args.image_repo, args.image_tag)
+        result["timings"]["publish"] = round(time.monotonic() - step, 3)
+
+        if args.deploy:
+            module = shared["deploy"][region]
+            step = time.monotonic()
+            module["deploy"](result["version"])
+            result["timings"]["deploy"] = round(time.monotonic() - step, 3)
+            step = time.monotonic()
+            module["cleanup"](result["version"])
+            result["timings"]["cleanup"] = round(time.monotonic() - step, 3)
+    except Exception as e:
+        print(f"[!] Release failed: {e!r}")
+        result["error"] = repr(e)
+    result["timings"]["total"] = round(time.monotonic() - start, 3)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Publish and deploy SCF in several regions concurrently.")
+    parser.add_argument("--regions", type=str, default=",".join(SCF_REGIONS), help="The comma-separated regions, SCF_REGIONS by default.")
+    parser.add_argument("--deploy", action="store_true", help="Also deploy and clean up the published version with deploy-scf-version.py.")
+    parser.add_argument("--force", action="store_true", help="Publish ZIP packages even if the latest version has the same package hash.")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+    parser_zip = subparsers.add_parser("zip", help="Publish a ZIP package.")
+    parser_zip.add_argument("file", help="The path of ZIP package.", type=str)
+    parser_zip.add_argument("--cos-bucket", type=str, help="Stage the package in this COS bucket (name-appid), '{region}' is replaced by each region.")
+    parser_docker = subparsers.add_parser("docker", help="Publish a Docker image.")
+    parser_docker.add_argument("image_repo", help="Docker image repository to deploy.")
+    parser_docker.add_argument("image_tag", help="Docker image tag to deploy.")
+    args = parser.parse_args()
+
+    regions = [region.strip() for region in args.regions.split(",") if region.strip()]
+    if not regions:
+        parser.error("--regions or SCF_REGIONS is required.")
+
+    # Load per-region modules serially, since they read the environment while importing.
+    script = "publish-scf-zip.py" if args.mode == "zip" else "publish-scf-docker.py"
+    shared = {
+        "publish": {region: load_region(region, script) for region in regions},
+        "deploy": {region: load_region(region, "deploy-scf-version.py") for region in regions} if args.deploy else {},
+        "description": None,
+        "code": None,
+    }
+    if args.mode == "zip":
+        # Hash and encode the package once for all regions.
+        module = shared["publish"][regions[0]]
+        shared["description"] = f"{module['SCF_HASH_PREFIX']}{module['package_hash'](args.file)}"
+        for region in regions if args.cos_bucket else []:
+            try:
+                module["cos_bucket_name"](args.cos_bucket.format(region=region))
+            except ValueError as e:
+                parser.error(str(e))
+        if not args.cos_bucket:
+            if os.path.getsize(args.file) > module["SCF_INLINE_LIMIT"]:
+                parser.error("The size of ZIP package should be less than 20MB, use --cos-bucket for larger packages.")
+            shared["code"] = {"ZipFile": module["encode_package"](args.file)}
+
+    stdout = sys.stdout
+    stream = RegionStream(sys.stderr)
+    sys.stdout = sys.stderr = stream
+    start = time.monotonic()
+    try:
+        with stream.inherited(), ThreadPoolExecutor(max_workers=len(regions)) as executor:
+            results = list(executor.map(lambda region: release_region(region, args, stream, shared), regions))
+    finally:
+        sys.stdout, sys.stderr = stdout, stream.stream
+
+    failed = [result["region"] for result in results if "error" in result]
+    print(f"[*] Released {len(regions) - len(failed)}/{len(regions)} regions in {time.monotonic() - start:.2f}s.", file=sys.stderr)
+    print(json.dumps({"seconds": round(time.monotonic() - start, 3), "regions": results}, indent=2))
+    if failed:
+        sys.exit(1)
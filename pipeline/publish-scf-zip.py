@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
 import argparse
 import base64
+import hashlib
 import os
+import re
 import sys
-import time
-from tencentcloud.common import credential
-from tencentcloud.scf.v20180416 import scf_client, models
+import zipfile
+from tencentcloud.scf.v20180416 import models
+from common import describe_response, get_cos_client, get_scf_client, traced, wait_until as poll_until
 
 
 ###########################################################
@@ -14,20 +16,15 @@ from tencentcloud.scf.v20180416 import scf_client, models
 SCF_REGION = os.environ["SCF_REGION"]
 SCF_NAMESPACE = os.environ["SCF_NAMESPACE"]
 SCF_FUNCTION = os.environ["SCF_FUNCTION"]
+SCF_WAIT_TIMEOUT = float(os.environ.get("SCF_WAIT_TIMEOUT", "600"))
+SCF_INLINE_LIMIT = 20 * 1024 * 1024
+SCF_CHUNK_SIZE = 3 * 1024 * 1024
+SCF_HASH_PREFIX = "sha256:"
 
 ###########################################################
 # Setup Tencent Cloud Client
 ###########################################################
-TENCENT_CLOUD_SECRET_ID = os.environ["TENCENT_CLOUD_SECRET_ID"]
-TENCENT_CLOUD_SECRET_KEY = os.environ["TENCENT_CLOUD_SECRET_KEY"]
-
-TENCENT_SCF_CLIENT = scf_client.ScfClient(
-    credential.Credential(
-        TENCENT_CLOUD_SECRET_ID,
-        TENCENT_CLOUD_SECRET_KEY,
-    ),
-    SCF_REGION,
-)
+TENCENT_SCF_CLIENT = get_scf_client(SCF_REGION)
 
 
 def new_default_request(req):
@@ -35,30 +32,97 @@ def new_default_request(req):
     req.FunctionName = SCF_FUNCTION
     return req
 
-def wait_until(version: str, status: str):
-    while True:
+def wait_until(version: str, status: str) -> list[dict]:
+    def poll():
         req = new_default_request(models.GetFunctionRequest())
         req.Qualifier = version
         req.ShowCode = "FALSE"
         resp = TENCENT_SCF_CLIENT.GetFunction(req)
-        if resp.Status == status:
-            return
-        time.sleep(1)
-
-def publish(file_content: str) -> str:
+        reasons = "; ".join(f"{r.ErrorCode}: {r.ErrorMessage}" for r in resp.StatusReasons or [])
+        return resp.Status, reasons or resp.StatusDesc
+
+    return poll_until(poll, status, f"SCF function {SCF_FUNCTION} version {version}", SCF_WAIT_TIMEOUT)
+
+def encode_package(path: str) -> str:
+    # Encode chunks of 3 bytes multiples into one preallocated buffer, so only the encoded package
+    # and its final string are ever held as a whole.
+    size = os.path.getsize(path)
+    encoded = bytearray(4 * -(-size // 3))
+    with open(path, "rb") as f:
+        for offset in range(0, size, SCF_CHUNK_SIZE):
+            start = offset // 3 * 4
+            encoded[start:start + SCF_CHUNK_SIZE // 3 * 4] = base64.b64encode(f.read(SCF_CHUNK_SIZE))
+    return encoded.decode("ascii")
+
+def cos_bucket_name(bucket: str) -> str:
+    # SCF expects the bucket name without the APPID suffix.
+    match = re.fullmatch(r"(.+)-(\d+)", bucket)
+    if match is None:
+        raise ValueError(f"COS bucket '{bucket}' should be named 'name-appid'.")
+    return match.group(1)
+
+def package_hash(path: str) -> str:
+    # Hash member names, modes and contents, so timestamps and compression do not change it.
+    sha256 = hashlib.sha256()
+    with zipfile.ZipFile(path) as package:
+        for info in sorted(package.infolist(), key=lambda info: info.filename):
+            if info.is_dir():
+                continue
+            sha256.update(f"{info.filename}\0{info.external_attr >> 16:o}\0".encode("utf-8"))
+            with package.open(info) as f:
+                for chunk in iter(lambda: f.read(SCF_CHUNK_SIZE), b""):
+                    sha256.update(chunk)
+            sha256.update(b"\0")
+    return sha256.hexdigest()
+
+def latest_published_version() -> tuple[str, str] | None:
+    req = new_default_request(models.ListVersionByFunctionRequest())
+    req.Offset = 0
+    req.Limit = 1
+    req.Order = "DESC"
+    req.OrderBy = "AddTime"
+    resp = TENCENT_SCF_CLIENT.ListVersionByFunction(req)
+    for version in resp.Versions or []:
+        if version.Version != "$LATEST":
+            return version.Version, version.Description or ""
+    return None
+
+@traced("stage_package")
+def stage_package(path: str, bucket: str, region: str) -> dict:
+    name = cos_bucket_name(bucket)
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(SCF_CHUNK_SIZE), b""):
+            md5.update(chunk)
+    key = f"scf-staging/{SCF_NAMESPACE}/{SCF_FUNCTION}/{md5.hexdigest()}.zip"
+
+    # Stream the package from disk in parts instead of inlining it into the request.
+    get_cos_client(region).upload_file(Bucket=bucket, Key=key, LocalFilePath=path, EnableMD5=True)
+    print(f"[*] Staged ZIP package to COS '{bucket}/{key}'.", file=sys.stderr)
+
+    return {
+        "CosBucketName": name,
+        "CosObjectName": key,
+        "CosBucketRegion": region,
+    }
+
+@traced("publish")
+def publish(code: dict, description: str | None = None) -> str:
     # Update $LATEST codes.
     req = new_default_request(models.UpdateFunctionCodeRequest())
-    req.ZipFile = file_content
+    for name, value in code.items():
+        setattr(req, name, value)
     resp = TENCENT_SCF_CLIENT.UpdateFunctionCode(req)
-    print(f"[*] Updated SCF function {SCF_FUNCTION}. Response: {resp}", file=sys.stderr)
+    print(f"[*] Updated SCF function {SCF_FUNCTION}. {describe_response(resp)}", file=sys.stderr)
 
     # Wait until $LATEST version online.
     wait_until("$LATEST", "Active")
 
     # Publish $LATEST version.
     req = new_default_request(models.PublishVersionRequest())
+    req.Description = description
     resp = TENCENT_SCF_CLIENT.PublishVersion(req)
-    print(f"[*] Published SCF version: {resp.FunctionVersion}. Response: {resp}", file=sys.stderr)
+    print(f"[*] Published SCF version: {resp.FunctionVersion}. {describe_response(resp)}", file=sys.stderr)
 
     # Wait until published version online.
     wait_until(resp.FunctionVersion, "Active")
@@ -68,17 +132,33 @@ def publish(file_content: str) -> str:
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Deploy SCF with ZIP package.")
     parser.add_argument("file", help="The path of ZIP package.", type=str)
+    parser.add_argument("--cos-bucket", type=str, help="Stage the package in this COS bucket (name-appid) instead of inlining it, which lifts the 20MB limit.")
+    parser.add_argument("--cos-region", type=str, default=SCF_REGION, help="The region of the staging COS bucket.")
+    parser.add_argument("--force", action="store_true", help="Publish a new version even if the latest one has the same package hash.")
     args = parser.parse_args()
-
-    # Check file size.
-    if os.path.getsize(args.file) > 20 * 1024 * 1024:
-        print("[!] The size of ZIP package should be less than 20MB.", file=sys.stderr)
-        exit(1)
-
-    # Encode file to base64.
-    with open(args.file, "rb") as f:
-        file_content = base64.b64encode(f.read()).decode("utf-8")
+    if args.cos_bucket:
+        try:
+            cos_bucket_name(args.cos_bucket)
+        except ValueError as e:
+            parser.error(str(e))
+
+    # The latest published version records its package hash in the description.
+    description = f"{SCF_HASH_PREFIX}{package_hash(args.file)}"
+    latest = None if args.force else latest_published_version()
+    if latest is not None and latest[1] == description:
+        print(f"[*] SCF version {latest[0]} already has package {description}, skipping publish.", file=sys.stderr)
+        print(latest[0], end="", file=sys.stdout)
+        sys.exit(0)
+
+    if args.cos_bucket:
+        code = stage_package(args.file, args.cos_bucket, args.cos_region)
+    else:
+        # Check file size.
+        if os.path.getsize(args.file) > SCF_INLINE_LIMIT:
+            print("[!] The size of ZIP package should be less than 20MB, use --cos-bucket for larger packages.", file=sys.stderr)
+            exit(1)
+        code = {"ZipFile": encode_package(args.file)}
 
     # Deploy SCF.
-    version = publish(file_content)
+    version = publish(code, description)
     print(version, end="", file=sys.stdout)
\ No newline at end of file
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import io
+import json
+import os
+import runpy
+import sys
+import time
+from string import Template
+
+
+###########################################################
+# Pipeline Config
+###########################################################
+PIPELINE_HOME = os.path.dirname(os.path.abspath(__file__))
+
+
+class Tee(io.TextIOBase):
+    def __init__(self, *streams):
+        self.streams = streams
+
+    def write(self, text: str) -> int:
+        for stream in self.streams:
+            stream.write(text)
+        return len(text)
+
+    def flush(self):
+        for stream in self.streams:
+            stream.flush()
+
+
+def run_step(step: dict, outputs: dict[str, str]) -> str:
+    # Outputs of earlier steps are referenced as ${name} in env values and arguments.
+    env = {name: Template(str(value)).safe_substitute(outputs) for name, value in step.get("env", {}).items()}
+    argv = [Template(str(arg)).safe_substitute(outputs) for arg in step.get("args", [])]
+    script = os.path.join(PIPELINE_HOME, step["script"])
+
+    saved_env, saved_argv = dict(os.environ), sys.argv
+    os.environ.update(env)
+    sys.argv = [script, *argv]
+    captured = io.StringIO()
+    try:
+        # Scripts print their result to stdout, so capture it while still streaming it to the log.
+        with contextlib.redirect_stdout(Tee(captured, sys.stderr)):
+            runpy.run_path(script, run_name="__main__")
+        if not captured.getvalue().endswith("\n"):
+            print(file=sys.stderr)
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            raise
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_env)
+        sys.argv = saved_argv
+    return captured.getvalue().strip()
+
+
+def run_pipeline(spec: dict) -> list[dict]:
+    os.environ.update({name: str(value) for name, value in spec.get("env", {}).items()})
+
+    outputs = {}
+    results = []
+    for step in spec["steps"]:
+        print(f"[*] Running step {step['name']}: {step['script']}", file=sys.stderr)
+        start = time.monotonic()
+        try:
+            outputs[step["name"]] = run_step(step, outputs)
+        except BaseException as e:
+            results.append({"name": step["name"], "seconds": round(time.monotonic() - start, 3), "error": repr(e)})
+            print(f"[!] Step {step['name']} failed: {e!r}", file=sys.stderr)
+            break
+        results.append({"name": step["name"], "seconds": round(time.monotonic() - start, 3), "output": outputs[step["name"]]})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run pipeline scripts in one process, passing outputs between steps.")
+    parser.add_argument("spec", help="The JSON file declaring the env and steps of the pipeline.", type=str)
+    args = parser.parse_args()
+
+    with open(args.spec, "r") as f:
+        spec = json.load(f)
+    results = run_pipeline(spec)
+
+    for result in results:
+        status = "failed" if "error" in result else "done"
+        print(f"[*] Step {result['name']} {status} in {result['seconds']:.2f}s.", file=sys.stderr)
+    print(json.dumps(results, indent=2))
+    if any("error" in result for result in results):
+        sys.exit(1)
@@ -1,11 +1,29 @@
 #!/usr/bin/env python3
 import argparse
+import contextlib
+import fnmatch
+import gzip
+import hashlib
+import json
+import mimetypes
 import os
+import queue
+import random
+import shutil
 import sys
-from concurrent.futures import ThreadPoolExecutor
-from qcloud_cos import CosConfig
-from qcloud_cos import CosS3Client
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
 from qcloud_cos.cos_exception import CosClientError, CosServiceError
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout as RequestsTimeout
+from common import get_cos_client, retry_attempt, traced
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 
 ###########################################################
@@ -14,23 +32,45 @@ from qcloud_cos.cos_exception import CosClientError, CosServiceError
 COS_REGION = os.environ["COS_REGION"]
 COS_BUCKET = os.environ["COS_BUCKET"]
 COS_UPLOAD_RETRY = 3
+COS_THROTTLE_RETRY = 8
+COS_BACKOFF_BASE = 1.0
+COS_BACKOFF_MAX = 30.0
+COS_LIST_PAGE_SIZE = 1000
+COS_HASH_CHUNK_SIZE = 1024 * 1024
+COS_MAX_PARTS = 10000
+COS_MAX_COPY_SIZE = 5 * 1024 * 1024 * 1024
+COS_COMPRESS_SUFFIXES = {"gzip": "gz", "br": "br"}
+COS_COMPRESS_MIN_RATIO = 0.9
+COS_DELETE_BATCH_SIZE = 1000
+COS_RELEASE_INDEX = ".releases.json"
+COS_HEADER_PARAMS = {
+    "cache-control": "CacheControl",
+    "content-type": "ContentType",
+    "content-encoding": "ContentEncoding",
+    "content-disposition": "ContentDisposition",
+    "content-language": "ContentLanguage",
+    "expires": "Expires",
+}
+
+# Uploads ramp concurrency up additively while healthy and halve it on throttling or congestion.
+COS_THROTTLE_STATUS_CODES = (429, 503)
+COS_THROTTLE_ERROR_CODES = ("SlowDown", "RequestLimitExceeded", "ServiceUnavailable")
+COS_NETWORK_ERRORS = (RequestsConnectionError, RequestsTimeout, ConnectionError, TimeoutError)
+COS_AIMD_DECREASE = 0.5
+COS_LATENCY_UNIT = 1024 * 1024
+COS_LATENCY_TOLERANCE = 2.0
 
 ###########################################################
 # Setup Tencent Cloud Client
 ###########################################################
-TENCENT_CLOUD_SECRET_ID = os.environ["TENCENT_CLOUD_SECRET_ID"]
-TENCENT_CLOUD_SECRET_KEY = os.environ["TENCENT_CLOUD_SECRET_KEY"]
-
-COS_CLIENT = CosS3Client(CosConfig(
-    Region=COS_REGION,
-    SecretId=TENCENT_CLOUD_SECRET_ID,
-    SecretKey=TENCENT_CLOUD_SECRET_KEY,
-))
+COS_CLIENT = get_cos_client(COS_REGION)
+COS_LIMITER = None
+COS_BANDWIDTH = None
 
 
 def check_file_exists(target: str) -> bool:
     try:
-        COS_CLIENT.head_object(Bucket=COS_BUCKET, Key=target)
+        cos_request(lambda: COS_CLIENT.head_object(Bucket=COS_BUCKET, Key=target), f"check '{target}'")
         return True
     except CosServiceError as e:
         if e.get_status_code() == 404 or e.get_error_code() == "NoSuchResource":
@@ -38,38 +78,851 @@ def check_file_exists(target: str) -> bool:
         print(f"[!] Failed to check file '{target}' in COS. Error: {e}")
         return False
 
-def upload_file(source: str, target: str):
+def header_params(headers: dict) -> dict:
+    # Translate HTTP header names into COS SDK keyword arguments.
+    params = {}
+    for name, value in headers.items():
+        if name.startswith("x-cos-meta-"):
+            params.setdefault("Metadata", {})[name] = value
+        else:
+            params[COS_HEADER_PARAMS[name]] = value
+    return params
+
+class AdaptiveLimiter:
+    def __init__(self, initial: int, minimum: int, maximum: int):
+        self.condition = threading.Condition()
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.peak = self.limit
+        self.active = 0
+        self.latency = None
+        self.best = None
+        self.round_trip = None
+        self.cut_at = 0.0
+        self.throttled = 0
+
+    def acquire(self):
+        with self.condition:
+            while self.active >= int(self.limit):
+                self.condition.wait()
+            self.active += 1
+
+    def release(self, seconds: float, size: int, throttled: bool = False, failed: bool = False):
+        with self.condition:
+            self.active -= 1
+            if throttled:
+                self.throttled += 1
+                self.decrease(seconds)
+            elif not failed and size >= COS_LATENCY_UNIT:
+                # Only transfers of at least a unit are scored, per unit, since small requests are all round trip.
+                score = seconds / (size / COS_LATENCY_UNIT)
+                self.latency = score if self.latency is None else self.latency * 0.8 + score * 0.2
+                self.best = self.latency if self.best is None else min(self.best, self.latency)
+                # The per-unit score detects congestion, while cuts are spaced by the round trip in seconds.
+                self.round_trip = seconds if self.round_trip is None else self.round_trip * 0.8 + seconds * 0.2
+                if self.latency > self.best * COS_LATENCY_TOLERANCE:
+                    self.decrease(seconds)
+                else:
+                    self.increase()
+            elif not failed:
+                self.increase()
+            self.condition.notify_all()
+
+    def increase(self):
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self.peak = max(self.peak, self.limit)
+
+    def decrease(self, seconds: float):
+        # Cut at most once per round trip, so one burst of throttled responses does not collapse the limit.
+        now = time.monotonic()
+        if now - self.cut_at < max(seconds, self.round_trip or 0):
+            return
+        self.limit = max(self.minimum, self.limit * COS_AIMD_DECREASE)
+        self.cut_at = now
+
+    def summary(self) -> str:
+        return f"concurrency {int(self.limit)} (peak {int(self.peak)}), {self.throttled} throttled requests"
+
+class TokenBucket:
+    def __init__(self, rate: float):
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.capacity = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def acquire(self, amount: int):
+        # Bytes are reserved up front, so a request larger than the bucket just waits out its debt.
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+def is_throttled(e: Exception) -> bool:
+    if isinstance(e, CosServiceError):
+        return e.get_status_code() in COS_THROTTLE_STATUS_CODES or e.get_error_code() in COS_THROTTLE_ERROR_CODES
+    # The SDK raises client errors while handling the original one, and only timeouts and dropped
+    # connections mean a congested link. Bad parameters and local errors never succeed on retry.
+    return isinstance(e, CosClientError) and isinstance(e.__context__, COS_NETWORK_ERRORS)
+
+def is_retryable(e: Exception) -> bool:
+    if isinstance(e, CosServiceError):
+        return is_throttled(e) or e.get_status_code() >= 500 or e.get_status_code() == 408
+    return is_throttled(e)
+
+def cos_request(call, label: str, size: int = 0):
+    # Throttled requests get more attempts than hard failures, all with full jitter backoff.
+    attempt = 0
+    while True:
+        if COS_BANDWIDTH is not None and size:
+            COS_BANDWIDTH.acquire(size)
+        if COS_LIMITER is not None:
+            COS_LIMITER.acquire()
+        start = time.monotonic()
+        try:
+            with retry_attempt(attempt):
+                result = call()
+        except (CosClientError, CosServiceError) as e:
+            throttled = is_throttled(e)
+            if COS_LIMITER is not None:
+                COS_LIMITER.release(time.monotonic() - start, size, throttled=throttled, failed=True)
+            attempt += 1
+            if not is_retryable(e) or attempt >= (COS_THROTTLE_RETRY if throttled else COS_UPLOAD_RETRY):
+                raise
+            delay = random.uniform(0, min(COS_BACKOFF_MAX, COS_BACKOFF_BASE * 2 ** attempt))
+            print(f"[!] Failed to {label} (attempt {attempt}), retrying in {delay:.1f}s. Error: {e}")
+            time.sleep(delay)
+            continue
+        if COS_LIMITER is not None:
+            COS_LIMITER.release(time.monotonic() - start, size)
+        return result
+
+class UploadPolicy:
+    def __init__(self, path: str):
+        with open(path, "r") as f:
+            policy = json.load(f)
+        self.rules = []
+        for rule in policy.get("rules", []):
+            patterns = rule["match"] if isinstance(rule["match"], list) else [rule["match"]]
+            headers = {name.lower(): str(value) for name, value in rule.get("headers", {}).items()}
+            for name in headers:
+                if name not in COS_HEADER_PARAMS and not name.startswith("x-cos-meta-"):
+                    raise ValueError(f"Unsupported header '{name}' in policy '{path}'.")
+            self.rules.append((patterns, headers))
+
+    def headers_for(self, relative: str) -> dict:
+        # Every matching rule applies in order, so later rules override earlier ones.
+        headers = {}
+        for patterns, rule_headers in self.rules:
+            if any(fnmatch.fnmatchcase(relative, pattern) for pattern in patterns):
+                headers.update(rule_headers)
+        return headers
+
+@traced("upload_file")
+def upload_file(source: str, target: str, args: argparse.Namespace | None = None, headers: dict | None = None):
     print(f"[*] Uploading '{source}' to COS '{target}'......")
-    for _ in range(COS_UPLOAD_RETRY):
-        COS_CLIENT.upload_file(
-            Bucket=COS_BUCKET,
-            Key=target,
-            LocalFilePath=source,
-            EnableMD5=True,
+    headers = headers or {}
+    if args is not None and os.path.getsize(source) >= args.multipart_threshold * 1024 * 1024:
+        multipart_upload(source, target, args, headers)
+        return
+
+    # A single PUT keeps the content MD5 as ETag, while the SDK's upload_file would split
+    # anything over 1MB into its own multipart upload, outside the limiter.
+    def put():
+        with open(source, "rb") as f:
+            return COS_CLIENT.put_object(
+                Bucket=COS_BUCKET,
+                Key=target,
+                Body=f,
+                EnableMD5=True,
+                **header_params(headers),
+            )
+    cos_request(put, f"upload '{source}'", os.path.getsize(source))
+
+def checkpoint_path(checkpoint_dir: str, target: str) -> str:
+    name = hashlib.md5(f"{COS_BUCKET}/{normalize_key(target)}".encode("utf-8")).hexdigest()
+    return os.path.join(checkpoint_dir, f"{name}.json")
+
+def save_checkpoint(path: str, checkpoint: dict):
+    temp = f"{path}.tmp"
+    with open(temp, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(temp, path)
+
+def list_uploaded_parts(target: str, upload_id: str) -> dict[int, dict]:
+    parts = {}
+    marker = "0"
+    while True:
+        resp = cos_request(lambda: COS_CLIENT.list_parts(Bucket=COS_BUCKET, Key=target, UploadId=upload_id, PartNumberMarker=marker), f"list parts of '{target}'")
+        for part in resp.get("Part", []):
+            parts[int(part["PartNumber"])] = {"etag": part["ETag"], "size": int(part["Size"])}
+        if resp.get("IsTruncated") != "true":
+            return parts
+        marker = resp["NextPartNumberMarker"]
+
+def resume_multipart_upload(path: str, identity: dict) -> tuple[str, dict[int, str]] | None:
+    try:
+        with open(path, "r") as f:
+            checkpoint = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    upload_id = checkpoint.get("upload_id")
+    if any(checkpoint.get(name) != value for name, value in identity.items()):
+        # The local file or part layout changed, so the old parts are useless.
+        try:
+            COS_CLIENT.abort_multipart_upload(Bucket=COS_BUCKET, Key=identity["key"], UploadId=upload_id)
+        except (CosClientError, CosServiceError):
+            pass
+        return None
+
+    try:
+        uploaded = list_uploaded_parts(identity["key"], upload_id)
+    except CosServiceError as e:
+        print(f"[!] Cannot resume multipart upload {upload_id}. Error: {e}")
+        return None
+
+    # Trust only parts that both the checkpoint and COS agree on.
+    parts = {}
+    for number, etag in checkpoint.get("parts", {}).items():
+        part = uploaded.get(int(number))
+        if part is not None and part["etag"] == etag:
+            parts[int(number)] = etag
+    return upload_id, parts
+
+def upload_part(source: str, target: str, upload_id: str, number: int, offset: int, length: int) -> str:
+    with open(source, "rb") as f:
+        f.seek(offset)
+        body = f.read(length)
+    resp = cos_request(lambda: COS_CLIENT.upload_part(
+        Bucket=COS_BUCKET,
+        Key=target,
+        Body=body,
+        PartNumber=number,
+        UploadId=upload_id,
+        EnableMD5=True,
+    ), f"upload part {number} of '{source}'", length)
+    return resp["ETag"]
+
+@traced("multipart_upload")
+def multipart_upload(source: str, target: str, args: argparse.Namespace, headers: dict):
+    stat = os.stat(source)
+    part_size = max(args.part_size * 1024 * 1024, -(-stat.st_size // COS_MAX_PARTS))
+    part_count = max(1, -(-stat.st_size // part_size))
+    identity = {
+        "bucket": COS_BUCKET,
+        "key": normalize_key(target),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "part_size": part_size,
+    }
+
+    os.makedirs(args.checkpoint_dir, exist_ok=True)
+    path = checkpoint_path(args.checkpoint_dir, target)
+    resumed = resume_multipart_upload(path, identity)
+    if resumed is not None:
+        upload_id, parts = resumed
+        print(f"[*] Resuming multipart upload of '{source}' with {len(parts)}/{part_count} parts done.")
+    else:
+        upload_id = cos_request(lambda: COS_CLIENT.create_multipart_upload(Bucket=COS_BUCKET, Key=target, **header_params(headers)), f"start multipart upload of '{source}'")["UploadId"]
+        parts = {}
+    checkpoint = {**identity, "upload_id": upload_id, "parts": {str(number): etag for number, etag in parts.items()}}
+    save_checkpoint(path, checkpoint)
+
+    # Upload the missing parts in parallel, checkpointing each one as it lands.
+    lock = threading.Lock()
+    failed = []
+
+    def run(number: int):
+        offset = (number - 1) * part_size
+        try:
+            etag = upload_part(source, target, upload_id, number, offset, min(part_size, stat.st_size - offset))
+        except (OSError, CosClientError, CosServiceError) as e:
+            print(f"[!] Giving up part {number} of '{source}'. Error: {e}")
+            failed.append(number)
+            return
+        with lock:
+            parts[number] = etag
+            checkpoint["parts"][str(number)] = etag
+            save_checkpoint(path, checkpoint)
+
+    # Reading the results re-raises unexpected errors, and COS would accept a partial part list.
+    with ThreadPoolExecutor(max_workers=args.part_workers) as executor:
+        list(executor.map(run, [number for number in range(1, part_count + 1) if number not in parts]))
+    if failed:
+        raise CosClientError(f"Failed to upload parts {sorted(failed)} of '{source}', rerun to resume from checkpoint.")
+    if len(parts) != part_count:
+        raise CosClientError(f"Uploaded {len(parts)}/{part_count} parts of '{source}', rerun to resume from checkpoint.")
+
+    cos_request(lambda: COS_CLIENT.complete_multipart_upload(
+        Bucket=COS_BUCKET,
+        Key=target,
+        UploadId=upload_id,
+        MultipartUpload={"Part": [{"PartNumber": number, "ETag": parts[number]} for number in sorted(parts)]},
+    ), f"complete multipart upload of '{source}'")
+    os.remove(path)
+
+def normalize_key(key: str) -> str:
+    return key.lstrip("/")
+
+def list_remote_objects(prefix: str) -> dict[str, dict]:
+    objects = {}
+    marker = ""
+    while True:
+        resp = cos_request(lambda: COS_CLIENT.list_objects(Bucket=COS_BUCKET, Prefix=prefix, Marker=marker, MaxKeys=COS_LIST_PAGE_SIZE), f"list '{prefix}'")
+        contents = resp.get("Contents", [])
+        for obj in contents:
+            objects[obj["Key"]] = {"size": int(obj["Size"]), "etag": obj["ETag"].strip('"')}
+        if resp.get("IsTruncated") != "true" or not contents:
+            return objects
+        marker = resp.get("NextMarker") or contents[-1]["Key"]
+
+def load_manifest(path: str, target: str) -> dict[str, dict]:
+    try:
+        with open(path, "r") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        print(f"[!] Ignoring corrupted manifest '{path}'. Error: {e}")
+        return {}
+    if manifest.get("bucket") != COS_BUCKET or manifest.get("target") != target:
+        return {}
+    return manifest.get("files", {})
+
+def save_manifest(path: str, target: str, files: dict[str, dict]):
+    temp = f"{path}.tmp"
+    with open(temp, "w") as f:
+        json.dump({"bucket": COS_BUCKET, "target": target, "files": files}, f, indent=2, sort_keys=True)
+    os.replace(temp, path)
+
+def hash_file(path: str) -> str:
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(COS_HASH_CHUNK_SIZE), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+def local_file_entry(path: str, previous: dict | None) -> dict:
+    stat = os.stat(path)
+    # Reuse the recorded hash if size and mtime are unchanged.
+    if previous and previous.get("size") == stat.st_size and previous.get("mtime") == stat.st_mtime_ns:
+        return previous
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "md5": hash_file(path)}
+
+def is_unchanged(size: int, digest: str, remote: dict | None, previous: dict | None) -> bool:
+    if remote is None or remote["size"] != size:
+        return False
+    # Single PUT uploads have the content MD5 as ETag.
+    if "-" not in remote["etag"]:
+        return remote["etag"] == digest
+    # Multipart ETags are not content hashes, so trust the manifest of the last sync.
+    return previous is not None and previous.get("digest", previous.get("md5")) == digest
+
+@dataclass
+class FileTask:
+    source: str
+    target: str
+    relative: str
+    size: int = 0
+    entry: dict | None = None
+    digest: str | None = None
+    copy_source: str | None = None
+    body: str | None = None
+    headers: dict = field(default_factory=dict)
+
+def compress_file(source: str, digest: str, encoding: str, cache_dir: str) -> tuple[str, str, int]:
+    # Compressed output is cached by source content, so unchanged files are never compressed twice.
+    path = os.path.join(cache_dir, f"{digest}.{COS_COMPRESS_SUFFIXES[encoding]}")
+    if not os.path.exists(path):
+        temp = f"{path}.{os.getpid()}.tmp"
+        with open(source, "rb") as src, open(temp, "wb") as dst:
+            if encoding == "gzip":
+                with gzip.GzipFile(fileobj=dst, mode="wb", compresslevel=9, mtime=0) as f:
+                    shutil.copyfileobj(src, f, COS_HASH_CHUNK_SIZE)
+            else:
+                compressor = brotli.Compressor(quality=11)
+                for chunk in iter(lambda: src.read(COS_HASH_CHUNK_SIZE), b""):
+                    dst.write(compressor.process(chunk))
+                dst.write(compressor.finish())
+        os.replace(temp, path)
+    return path, hash_file(path), os.path.getsize(path)
+
+class Compressor:
+    def __init__(self, args: argparse.Namespace):
+        self.encoding = args.compress
+        self.min_size = args.compress_min_size
+        self.extensions = {f".{ext.strip().lstrip('.').lower()}" for ext in args.compress_extensions.split(",")}
+        self.cache_dir = args.compress_cache
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.executor = ProcessPoolExecutor(max_workers=args.compress_workers)
+
+    def eligible(self, task: FileTask) -> bool:
+        return task.size >= self.min_size and os.path.splitext(task.relative)[1].lower() in self.extensions
+
+    def prepare(self, task: FileTask):
+        # Checker threads block here while the process pool does the CPU work.
+        future = self.executor.submit(compress_file, task.source, task.digest, self.encoding, self.cache_dir)
+        body, digest, size = future.result()
+        if size > task.size * COS_COMPRESS_MIN_RATIO:
+            return
+        task.body, task.digest, task.size = body, digest, size
+        task.headers["content-encoding"] = self.encoding
+        task.headers.setdefault("content-type", mimetypes.guess_type(task.relative)[0] or "application/octet-stream")
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+class BlobIndex:
+    def __init__(self, remote: dict[str, str] | None = None):
+        self.lock = threading.Lock()
+        self.sources = dict(remote or {})
+        self.remote = set(self.sources.values())
+        self.written = set()
+        self.failed = set()
+        self.pending = {}
+
+    def claim(self, task: FileTask) -> bool:
+        # The first key seen with a digest becomes the source of all later copies.
+        with self.lock:
+            source = self.sources.setdefault(task.digest, task.target)
+            if source == task.target:
+                self.written.add(task.target)
+                self.pending[task.target] = []
+                return True
+            task.copy_source = source
+            if source in self.pending:
+                # Copies of a source still in flight are handed out once it lands, see finish.
+                self.pending[source].append(task)
+                return False
+            return True
+
+    def finish(self, key: str, landed: bool) -> list[FileTask]:
+        with self.lock:
+            if not landed:
+                self.failed.add(key)
+            return self.pending.pop(key, [])
+
+    def usable(self, source: str) -> bool:
+        # A pre-existing remote object is stale once this run overwrote it.
+        with self.lock:
+            return source not in self.failed and not (source in self.remote and source in self.written)
+
+class TransferStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.scanned = 0
+        self.scanned_bytes = 0
+        self.uploaded = 0
+        self.uploaded_bytes = 0
+        self.skipped = 0
+        self.failed = 0
+        self.copied = 0
+        self.copied_bytes = 0
+
+    def add(self, **counters: int):
+        with self.lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def summary(self) -> str:
+        elapsed = max(time.monotonic() - self.start, 1e-6)
+        summary = (
+            f"{self.scanned} files scanned, {self.uploaded} uploaded, {self.skipped} skipped, {self.failed} failed "
+            f"in {elapsed:.2f}s ({self.scanned / elapsed:.1f} files/s, "
+            f"{self.uploaded_bytes / elapsed / 1024 / 1024:.2f} MB/s uploaded)"
         )
+        if self.copied:
+            ratio = self.copied / (self.uploaded + self.copied)
+            summary += (
+                f", {self.copied} duplicates copied server-side "
+                f"({self.copied_bytes / 1024 / 1024:.2f} MB saved, {ratio:.1%} dedup ratio)"
+            )
+        if COS_LIMITER is not None:
+            summary += f", {COS_LIMITER.summary()}"
+        return summary
 
-def upload_folder(source: str, target: str):
-    executor = ThreadPoolExecutor()
+def walk_folder(source: str, target: str, exclude: frozenset[str] = frozenset()):
     for path, _, file_list in os.walk(source):
         for file_name in file_list:
             source_file = os.path.join(path, file_name)
-            target_file = os.path.join(target, os.path.relpath(source_file, source))
-            exists = check_file_exists(target_file)
-            if not exists:
-                executor.submit(upload_file, source_file, target_file)
-    executor.shutdown(wait=True)
+            if os.path.abspath(source_file) in exclude:
+                continue
+            relative = os.path.relpath(source_file, source).replace(os.sep, "/")
+            yield FileTask(source_file, os.path.join(target, relative), relative)
+
+def copy_file(source: str, target: str, size: int, headers: dict | None = None):
+    print(f"[*] Copying COS '{source}' to COS '{target}'......")
+    copy_source = {"Bucket": COS_BUCKET, "Key": source, "Region": COS_REGION}
+    # Same bytes may still need different headers than the source object, the SDK sends them with CopyStatus "Replaced".
+    headers = {"CopyStatus": "Replaced", **header_params(headers)} if headers else {}
+    if size > COS_MAX_COPY_SIZE:
+        cos_request(lambda: COS_CLIENT.copy(Bucket=COS_BUCKET, Key=target, CopySource=copy_source, **headers), f"copy '{source}'")
+    else:
+        cos_request(lambda: COS_CLIENT.copy_object(Bucket=COS_BUCKET, Key=target, CopySource=copy_source, **headers), f"copy '{source}'")
+
+def transfer_file(task: FileTask, args: argparse.Namespace):
+    if task.copy_source is not None:
+        # The copy replaces the source object's headers, so it gets the target's own, typed like an upload.
+        headers = {"content-type": mimetypes.guess_type(task.relative)[0] or "application/octet-stream", **task.headers}
+        copy_file(task.copy_source, task.target, task.size, headers)
+    else:
+        upload_file(task.body or task.source, task.target, args, task.headers)
+
+def run_pipeline(tasks, check, upload, stats: TransferStats, check_workers: int, upload_workers: int, queue_size: int, dedup: BlobIndex | None = None):
+    # Walker -> checkers -> uploaders, joined by bounded queues so a huge tree never piles up in memory.
+    check_queue = queue.Queue(maxsize=queue_size)
+    upload_queue = queue.Queue(maxsize=queue_size)
+
+    # Workers catch every error and keep consuming their queue, so no producer ever blocks on a dead stage.
+    def walker():
+        try:
+            for task in tasks:
+                check_queue.put(task)
+        except Exception as e:
+            print(f"[!] Failed to walk source folder. Error: {e!r}")
+            stats.add(failed=1)
+        finally:
+            for _ in range(check_workers):
+                check_queue.put(None)
+
+    def checker():
+        while (task := check_queue.get()) is not None:
+            try:
+                needs_upload = check(task)
+            except Exception as e:
+                print(f"[!] Failed to check '{task.source}'. Error: {e!r}")
+                stats.add(scanned=1, failed=1)
+                continue
+            stats.add(scanned=1, scanned_bytes=task.size)
+            if not needs_upload:
+                stats.add(skipped=1)
+            elif dedup is None or dedup.claim(task):
+                upload_queue.put(task)
+
+    def transfer(task: FileTask):
+        if task.copy_source is not None and not dedup.usable(task.copy_source):
+            task.copy_source = None
+        try:
+            upload(task)
+        except Exception as e:
+            print(f"[!] Failed to {'copy' if task.copy_source is not None else 'upload'} '{task.source}'. Error: {e!r}")
+            stats.add(failed=1)
+            landed = False
+        else:
+            if task.copy_source is not None:
+                stats.add(copied=1, copied_bytes=task.size)
+            else:
+                stats.add(uploaded=1, uploaded_bytes=task.size)
+            landed = True
+        for duplicate in dedup.finish(task.target, landed) if dedup is not None else []:
+            try:
+                upload_queue.put_nowait(duplicate)
+            except queue.Full:
+                # Uploaders never block on their own queue, so a full one means copying right here.
+                transfer(duplicate)
+
+    def uploader():
+        while (task := upload_queue.get()) is not None:
+            try:
+                transfer(task)
+            finally:
+                upload_queue.task_done()
+
+    walker_thread = threading.Thread(target=walker, daemon=True)
+    checker_threads = [threading.Thread(target=checker, daemon=True) for _ in range(check_workers)]
+    uploader_threads = [threading.Thread(target=uploader, daemon=True) for _ in range(upload_workers)]
+    for thread in [walker_thread, *checker_threads, *uploader_threads]:
+        thread.start()
+
+    walker_thread.join()
+    for thread in checker_threads:
+        thread.join()
+    # Finished uploads still queue the copies waiting on them, so stop the uploaders only once the queue drained.
+    upload_queue.join()
+    for _ in range(upload_workers):
+        upload_queue.put(None)
+    for thread in uploader_threads:
+        thread.join()
+
+@traced("sync_folder")
+def sync_folder(source: str, target: str, manifest_path: str, args: argparse.Namespace, manifest_target: str | None = None, seed_prefix: str | None = None):
+    stats = TransferStats()
+    prefix = normalize_key(os.path.join(target, ""))
+    remote = list_remote_objects(prefix)
+    print(f"[*] Found {len(remote)} objects under COS prefix '{prefix}'.")
+    # Objects uploaded in one piece have their content MD5 as ETag, so they can seed copies.
+    dedup = None
+    if args.dedup or seed_prefix is not None:
+        seeds = {**list_remote_objects(seed_prefix), **remote} if seed_prefix is not None else remote
+        dedup = BlobIndex({obj["etag"]: key for key, obj in seeds.items() if "-" not in obj["etag"]})
+
+    # Releases share one manifest under their parent target, so hashes survive across release prefixes.
+    manifest_target = manifest_target or target
+    previous = load_manifest(manifest_path, manifest_target)
+    current = {}
+    policy = UploadPolicy(args.policy) if args.policy else None
+    compressor = Compressor(args) if args.compress else None
+
+    def check(task: FileTask) -> bool:
+        task.entry = local_file_entry(task.source, previous.get(task.relative))
+        task.size = task.entry["size"]
+        task.digest = task.entry["md5"]
+        if policy is not None:
+            task.headers.update(policy.headers_for(task.relative))
+        if compressor is not None and compressor.eligible(task):
+            compressor.prepare(task)
+        current[task.relative] = {**task.entry, "digest": task.digest}
+        return not is_unchanged(task.size, task.digest, remote.get(normalize_key(task.target)), previous.get(task.relative))
+
+    def upload(task: FileTask):
+        try:
+            transfer_file(task, args)
+        except Exception:
+            # Only record files that actually landed, so failures are retried next time.
+            current.pop(task.relative, None)
+            raise
+
+    tasks = walk_folder(source, target, frozenset([os.path.abspath(manifest_path)]))
+    try:
+        run_pipeline(tasks, check, upload, stats, args.check_workers, args.max_upload_workers, args.queue_size, dedup)
+    finally:
+        if compressor is not None:
+            compressor.shutdown()
+
+    save_manifest(manifest_path, manifest_target, current)
+    print(f"[*] Synced: {stats.summary()}")
+    if stats.failed:
+        sys.exit(1)
+
+def load_release_index(target: str) -> dict:
+    key = normalize_key(f"{target}/{COS_RELEASE_INDEX}")
+    try:
+        resp = COS_CLIENT.get_object(Bucket=COS_BUCKET, Key=key)
+    except CosServiceError as e:
+        if e.get_status_code() == 404:
+            return {"releases": []}
+        raise
+    return json.loads(resp["Body"].get_raw_stream().read())
+
+def save_release_index(target: str, index: dict):
+    COS_CLIENT.put_object(
+        Bucket=COS_BUCKET,
+        Key=normalize_key(f"{target}/{COS_RELEASE_INDEX}"),
+        Body=json.dumps(index, indent=2).encode("utf-8"),
+        ContentType="application/json",
+        CacheControl="no-cache",
+    )
+
+def delete_prefix(prefix: str) -> int:
+    keys = list(list_remote_objects(prefix))
+    for start in range(0, len(keys), COS_DELETE_BATCH_SIZE):
+        batch = keys[start:start + COS_DELETE_BATCH_SIZE]
+        resp = cos_request(lambda: COS_CLIENT.delete_objects(
+            Bucket=COS_BUCKET,
+            Delete={"Object": [{"Key": key} for key in batch], "Quiet": "true"},
+        ), f"delete {len(batch)} objects under '{prefix}'")
+        if resp.get("Error"):
+            raise CosClientError(f"Failed to delete {len(resp['Error'])} objects under '{prefix}': {resp['Error'][:3]}")
+    return len(keys)
+
+def hash_release(source: str, target: str, manifest_path: str, args: argparse.Namespace) -> str:
+    # Hash results go to the manifest, so the sync that follows does not read the files again.
+    previous = load_manifest(manifest_path, target)
+    tasks = list(walk_folder(source, target, frozenset([os.path.abspath(manifest_path)])))
+    with ThreadPoolExecutor(max_workers=args.check_workers) as executor:
+        entries = executor.map(lambda task: local_file_entry(task.source, previous.get(task.relative)), tasks)
+        files = {task.relative: entry for task, entry in zip(tasks, entries)}
+    save_manifest(manifest_path, target, files)
+
+    sha256 = hashlib.sha256()
+    for relative in sorted(files):
+        sha256.update(f"{relative}\0{files[relative]['md5']}\n".encode("utf-8"))
+    # Object headers are part of what a release serves, too.
+    sha256.update(f"{args.compress}\n".encode("utf-8"))
+    if args.policy:
+        with open(args.policy, "rb") as f:
+            sha256.update(f.read())
+    return sha256.hexdigest()[:16]
+
+@traced("deploy_release")
+def deploy_release(source: str, target: str, manifest_path: str, args: argparse.Namespace) -> str:
+    target = target.strip("/")
+    index = load_release_index(target)
+    releases = index.setdefault("releases", [])
+    if args.release == "hash":
+        release = hash_release(source, target, manifest_path, args)
+    else:
+        release = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    prefix = normalize_key(f"{target}/{release}")
+
+    existing = next((r for r in releases if r["id"] == release), None)
+    if existing is not None:
+        print(f"[*] Release {release} is already uploaded to COS '{prefix}'.")
+        releases.remove(existing)
+    else:
+        # Files unchanged since the newest release are copied server-side instead of uploaded again.
+        seed = f"{releases[-1]['prefix']}/" if releases else None
+        sync_folder(source, prefix, manifest_path, args, manifest_target=target, seed_prefix=seed)
+    releases.append({"id": release, "prefix": prefix, "created": datetime.now(timezone.utc).isoformat()})
+    # Old releases are pruned by --prune-releases once the gateway serves the new one.
+    save_release_index(target, index)
+    return prefix
+
+@traced("prune_releases")
+def prune_releases(target: str, live: str, keep: int):
+    target = target.strip("/")
+    live = normalize_key(live).rstrip("/")
+    index = load_release_index(target)
+    releases = index.setdefault("releases", [])
+    if not any(r["prefix"] == live for r in releases):
+        print(f"[!] Live prefix '{live}' is not a release of COS '{target}', refusing to prune.")
+        sys.exit(1)
+
+    # After a rollback the live release may be older than the newest ones, it is kept anyway.
+    kept = releases[-keep:] + [r for r in releases[:-keep] if r["prefix"] == live]
+    pruned = [r for r in releases if r not in kept]
+    # Record the index before deleting, so it never lists deleted prefixes.
+    index["releases"] = [r for r in releases if r in kept]
+    index["live"] = live
+    save_release_index(target, index)
+    for old in pruned:
+        deleted = delete_prefix(f"{old['prefix']}/")
+        print(f"[*] Pruned release {old['id']}: deleted {deleted} objects under COS '{old['prefix']}/'.")
+    print(f"[*] Kept {len(kept)} releases under COS '{target}', live at '{live}'.")
+
+@traced("upload_folder")
+def upload_folder(source: str, target: str, args: argparse.Namespace):
+    stats = TransferStats()
+
+    dedup = BlobIndex() if args.dedup else None
+    policy = UploadPolicy(args.policy) if args.policy else None
+    compressor = Compressor(args) if args.compress else None
+
+    def check(task: FileTask) -> bool:
+        task.size = os.path.getsize(task.source)
+        if check_file_exists(task.target):
+            return False
+        if dedup is not None or compressor is not None:
+            task.digest = hash_file(task.source)
+        if policy is not None:
+            task.headers.update(policy.headers_for(task.relative))
+        if compressor is not None and compressor.eligible(task):
+            compressor.prepare(task)
+        return True
+
+    def upload(task: FileTask):
+        transfer_file(task, args)
+
+    try:
+        run_pipeline(walk_folder(source, target), check, upload, stats, args.check_workers, args.max_upload_workers, args.queue_size, dedup)
+    finally:
+        if compressor is not None:
+            compressor.shutdown()
+    print(f"[*] Uploaded: {stats.summary()}")
+    if stats.failed:
+        sys.exit(1)
+
+@traced("apply_policy")
+def apply_policy(target: str, args: argparse.Namespace):
+    policy = UploadPolicy(args.policy)
+    prefix = normalize_key(os.path.join(target, ""))
+    remote = list_remote_objects(prefix)
+    print(f"[*] Re-applying policy '{args.policy}' to {len(remote)} objects under COS prefix '{prefix}'.")
+
+    def apply(key: str) -> str:
+        headers = policy.headers_for(key[len(prefix):])
+        if not headers:
+            return "skipped"
+        current = {name.lower(): value for name, value in cos_request(lambda: COS_CLIENT.head_object(Bucket=COS_BUCKET, Key=key), f"check '{key}'").items()}
+        if all(current.get(name) == value for name, value in headers.items()):
+            return "skipped"
+        # A replacing copy drops every header it is not given, so carry the current ones over.
+        kept = {name: value for name, value in current.items() if name in COS_HEADER_PARAMS or name.startswith("x-cos-meta-")}
+        copy_file(key, key, remote[key]["size"], {**kept, **headers})
+        return "updated"
+
+    results = {"updated": 0, "skipped": 0, "failed": 0}
+    with ThreadPoolExecutor(max_workers=args.check_workers) as executor:
+        futures = {executor.submit(apply, key): key for key in remote}
+        for future, key in futures.items():
+            try:
+                results[future.result()] += 1
+            except (CosClientError, CosServiceError) as e:
+                print(f"[!] Failed to re-apply policy to '{key}'. Error: {e}")
+                results["failed"] += 1
+    print(f"[*] Policy applied: {results['updated']} updated, {results['skipped']} unchanged, {results['failed']} failed.")
+    if results["failed"]:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Upload file/folder to COS.")
-    parser.add_argument("source", help="The local path of file/folder to upload.", type=str)
+    parser.add_argument("source", nargs="?", help="The local path of file/folder to upload.", type=str)
     parser.add_argument("target", help="The target path in COS bucket.", type=str)
+    parser.add_argument("--sync", action="store_true", help="Upload only new or changed files of a folder, based on one listing of the target prefix.")
+    parser.add_argument("--release", type=str, choices=["hash", "timestamp"], help="Upload a folder into a new '<target>/<release>' prefix named by content hash or timestamp, and print the prefix.")
+    parser.add_argument("--prune-releases", type=str, metavar="LIVE_PREFIX", help="After the cutover, delete releases under the target beyond --keep-releases, never the live prefix given here.")
+    parser.add_argument("--keep-releases", type=int, default=5, help="The number of newest releases --prune-releases keeps besides the live one, at least 2 for rollback.")
+    parser.add_argument("--manifest", type=str, default=".cos-manifest.json", help="The local manifest used by --sync to remember file hashes.")
+    parser.add_argument("--dedup", action="store_true", help="Upload identical files once and copy them server-side to every other path.")
+    parser.add_argument("--policy", type=str, help="The JSON policy mapping glob patterns of relative paths to object headers.")
+    parser.add_argument("--apply-policy", action="store_true", help="Re-apply --policy headers to existing objects under the target without uploading.")
+    parser.add_argument("--compress", type=str, choices=list(COS_COMPRESS_SUFFIXES), help="Pre-compress eligible text assets and upload them with this Content-Encoding.")
+    parser.add_argument("--compress-extensions", type=str, default="html,htm,css,js,mjs,json,map,svg,txt,xml,wasm", help="The comma-separated file extensions eligible for compression.")
+    parser.add_argument("--compress-min-size", type=int, default=1024, help="The minimum file size (bytes) worth compressing.")
+    parser.add_argument("--compress-workers", type=int, default=os.cpu_count(), help="The number of processes compressing files.")
+    parser.add_argument("--compress-cache", type=str, default=".cos-compress-cache", help="The folder caching compressed files by content hash.")
+    parser.add_argument("--check-workers", type=int, default=16, help="The number of workers checking files before upload.")
+    parser.add_argument("--upload-workers", type=int, default=8, help="The initial number of concurrent upload requests.")
+    parser.add_argument("--max-upload-workers", type=int, default=32, help="The number of concurrent upload requests the adaptive limit can ramp up to.")
+    parser.add_argument("--bandwidth-limit", type=float, default=0, help="Cap the upload bandwidth (MB/s) to leave room for production traffic, unlimited by default.")
+    parser.add_argument("--queue-size", type=int, default=1000, help="The maximum number of files buffered between pipeline stages.")
+    parser.add_argument("--multipart-threshold", type=int, default=64, help="The file size (MB) from which files are uploaded in parallel parts.")
+    parser.add_argument("--part-size", type=int, default=8, help="The size (MB) of each multipart upload part.")
+    parser.add_argument("--part-workers", type=int, default=4, help="The number of parts of one file uploaded in parallel.")
+    parser.add_argument("--checkpoint-dir", type=str, default=".cos-checkpoints", help="The folder keeping multipart upload checkpoints for resuming.")
     args = parser.parse_args()
+    if args.compress == "br" and brotli is None:
+        parser.error("--compress br requires the 'brotli' package.")
+    if args.apply_policy and not args.policy:
+        parser.error("--apply-policy requires --policy.")
+    if not args.apply_policy and not args.prune_releases and args.source is None:
+        parser.error("the source argument is required.")
+    if args.release and (args.source is None or not os.path.isdir(args.source)):
+        parser.error("--release requires a source folder.")
+    if args.keep_releases < 2:
+        parser.error("--keep-releases must keep at least 2 releases for rollback.")
+    if args.max_upload_workers < args.upload_workers:
+        parser.error("--max-upload-workers must not be less than --upload-workers.")
+
+    COS_LIMITER = AdaptiveLimiter(args.upload_workers, 1, args.max_upload_workers)
+    if args.bandwidth_limit > 0:
+        COS_BANDWIDTH = TokenBucket(args.bandwidth_limit * 1024 * 1024)
 
-    if os.path.isfile(args.source):
-        upload_file(args.source, args.target)
+    if args.apply_policy:
+        apply_policy(args.target, args)
+    elif args.prune_releases:
+        prune_releases(args.target, args.prune_releases, args.keep_releases)
+    elif args.release:
+        # Only the release prefix goes to stdout, so later pipeline steps can cut over to it.
+        with contextlib.redirect_stdout(sys.stderr):
+            prefix = deploy_release(args.source, args.target, args.manifest, args)
+        print(f"/{prefix}", end="", file=sys.stdout)
+    elif os.path.isfile(args.source):
+        # Rules match the key as they match keys under a folder target, so path globs work here too.
+        headers = UploadPolicy(args.policy).headers_for(normalize_key(args.target)) if args.policy else None
+        upload_file(args.source, args.target, args, headers)
+    elif os.path.isdir(args.source) and args.sync:
+        sync_folder(args.source, args.target, args.manifest, args)
     elif os.path.isdir(args.source):
-        upload_folder(args.source, args.target)
+        upload_folder(args.source, args.target, args)
     else:
         print(f"[!] Source path '{args.source}' is not a file or folder.")
         sys.exit(1)
\ No newline at end of file
@@ -1,9 +1,16 @@
 # -*- coding: utf8 -*-
 import base64
+import contextlib
+import functools
 import io
 import json
 import os
+import subprocess
+import threading
+import time
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from tencentcloud.common import credential
 from tencentcloud.ssl.v20191205 import ssl_client, models
 
@@ -13,6 +20,92 @@ from tencentcloud.ssl.v20191205 import ssl_client, models
 
 HOME = "/opt/acme.sh"
 CONFIG_HOME = "/mnt/etc/acme.sh"
+OPENSSL = os.environ.get("OPENSSL", "openssl")
+RENEW_DAYS = int(os.environ.get("RENEW_DAYS", "30"))
+ACME_TIMEOUT = float(os.environ.get("ACME_TIMEOUT", "300"))
+
+###########################################################
+# Handler Config
+###########################################################
+
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "8"))
+CERTIFICATE_INDEX_TTL = float(os.environ.get("CERTIFICATE_INDEX_TTL", "60"))
+CERTIFICATE_PAGE_SIZE = 1000
+# Certificate times in SSL API responses are in China Standard Time.
+CERTIFICATE_TIMEZONE = timezone(timedelta(hours=8))
+# Only the fields each step needs are logged, VERBOSE=true also dumps whole SDK responses.
+VERBOSE = os.environ.get("VERBOSE", "false").lower() == "true"
+
+###########################################################
+# Tracing
+###########################################################
+# Same span format as pipeline/common.py, inlined since the function ships as a single file.
+TRACE_FILE = os.environ.get("TRACE_FILE")
+
+TRACE_LOCK = threading.Lock()
+TRACE_LATENCIES = {}
+
+@contextlib.contextmanager
+def trace_span(operation: str):
+    span = {"request_bytes": 0, "response_bytes": 0}
+    start = time.monotonic()
+    outcome, error = "ok", None
+    try:
+        yield span
+    except BaseException as e:
+        outcome, error = "error", repr(e)
+        raise
+    finally:
+        latency = time.monotonic() - start
+        with TRACE_LOCK:
+            TRACE_LATENCIES.setdefault(operation, []).append((latency, outcome))
+            if TRACE_FILE:
+                with open(TRACE_FILE, "a") as f:
+                    f.write(json.dumps({
+                        "type": "span",
+                        "at": datetime.now(timezone.utc).isoformat(),
+                        "operation": operation,
+                        "latency_ms": round(latency * 1000, 3),
+                        "retries": 0,
+                        "outcome": outcome,
+                        "error": error,
+                        **span,
+                    }) + "\n")
+
+def trace_summary() -> dict:
+    summary = {}
+    with TRACE_LOCK:
+        for operation, calls in TRACE_LATENCIES.items():
+            latencies = sorted(latency for latency, _ in calls)
+            summary[operation] = {
+                "count": len(calls),
+                "errors": sum(outcome != "ok" for _, outcome in calls),
+                "p50_ms": round(latencies[round(0.5 * (len(latencies) - 1))] * 1000, 3),
+                "p95_ms": round(latencies[round(0.95 * (len(latencies) - 1))] * 1000, 3),
+                "total_ms": round(sum(latencies) * 1000, 3),
+            }
+    return summary
+
+class TracedClient:
+    def __init__(self, client, service: str):
+        self._client = client
+        self._service = service
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._client, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def call(req):
+            with trace_span(f"{self._service}.{name}") as span:
+                if TRACE_FILE:
+                    span["request_bytes"] = len(req.to_json_string())
+                resp = attr(req)
+                if TRACE_FILE:
+                    span["response_bytes"] = len(resp.to_json_string())
+                return resp
+        return call
 
 ###########################################################
 # Setup Tencent Cloud Client
@@ -20,22 +113,72 @@ CONFIG_HOME = "/mnt/etc/acme.sh"
 TENCENT_CLOUD_SECRET_ID = os.environ["TENCENT_CLOUD_SECRET_ID"]
 TENCENT_CLOUD_SECRET_KEY = os.environ["TENCENT_CLOUD_SECRET_KEY"]
 
-TENCENT_SSL_CLIENT = ssl_client.SslClient(
+TENCENT_SSL_CLIENT = TracedClient(ssl_client.SslClient(
     credential.Credential(
         TENCENT_CLOUD_SECRET_ID,
         TENCENT_CLOUD_SECRET_KEY,
     ),
     None,
-)
+), "ssl")
+
 
+# Kept at module level so warm invocations of the same instance reuse it.
+CERTIFICATE_INDEX = {"index": {}, "expires": 0.0}
+CERTIFICATE_INDEX_LOCK = threading.Lock()
 
-def search_latest_certificate(domain: str) -> str:
-    req = models.DescribeCertificatesRequest()
-    req.SearchKey = domain
-    req.ExpirationSort = "DESC"
-    req.FilterSource = "upload"
-    resp = TENCENT_SSL_CLIENT.DescribeCertificates(req)
-    return resp.Certificates[0].CertificateId
+def list_certificates() -> list:
+    certificates = []
+    while True:
+        req = models.DescribeCertificatesRequest()
+        req.Offset = len(certificates)
+        req.Limit = CERTIFICATE_PAGE_SIZE
+        req.FilterSource = "upload"
+        resp = TENCENT_SSL_CLIENT.DescribeCertificates(req)
+        certificates.extend(resp.Certificates or [])
+        if not resp.Certificates or len(certificates) >= resp.TotalCount:
+            return certificates
+
+def build_certificate_index() -> dict:
+    # Map every exact domain and SAN to its certificate expiring last.
+    index = {}
+    for certificate in list_certificates():
+        for name in {certificate.Domain, *(certificate.SubjectAltName or [])}:
+            current = index.get(name)
+            if current is None or certificate.CertEndTime > current.CertEndTime:
+                index[name] = certificate
+    return index
+
+def certificate_index() -> dict:
+    with CERTIFICATE_INDEX_LOCK:
+        if time.monotonic() >= CERTIFICATE_INDEX["expires"]:
+            CERTIFICATE_INDEX["index"] = build_certificate_index()
+            CERTIFICATE_INDEX["expires"] = time.monotonic() + CERTIFICATE_INDEX_TTL
+            print(f"[*] Indexed certificates of {len(CERTIFICATE_INDEX['index'])} domains.")
+        return CERTIFICATE_INDEX["index"]
+
+def invalidate_certificate_index():
+    with CERTIFICATE_INDEX_LOCK:
+        CERTIFICATE_INDEX["expires"] = 0.0
+
+def search_latest_certificate(domain: str):
+    certificate = certificate_index().get(domain)
+    if certificate is None:
+        raise Exception(f"No uploaded certificate found for domain {domain}.")
+    return certificate
+
+def read_certificate_validity(certificatePath: str) -> tuple[datetime, datetime]:
+    # Only the leaf certificate, the first one of the chain, is read.
+    output = subprocess.run(
+        [OPENSSL, "x509", "-in", certificatePath, "-noout", "-startdate", "-enddate"],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    fields = dict(line.strip().split("=", 1) for line in output.splitlines() if "=" in line)
+    parse = lambda value: datetime.strptime(value, "%b %d %H:%M:%S %Y %Z").replace(tzinfo=timezone.utc)
+    return parse(fields["notBefore"]), parse(fields["notAfter"])
+
+def online_certificate_validity(certificate) -> tuple[datetime, datetime]:
+    parse = lambda value: datetime.strptime(value, "%Y-%m-%d %H:%M:%S").replace(tzinfo=CERTIFICATE_TIMEZONE)
+    return parse(certificate.CertBeginTime), parse(certificate.CertEndTime)
 
 def download_certificate(domain: str, certificateID: str) -> bytes:
     req = models.DownloadCertificateRequest()
@@ -44,9 +187,11 @@ def download_certificate(domain: str, certificateID: str) -> bytes:
 
     zipContent = base64.b64decode(resp.Content)
     with zipfile.ZipFile(io.BytesIO(zipContent)) as zipFile:
-        zipFile.extractall("/tmp")
         return zipFile.read(f"{domain}.pem")
 
+def describe_response(resp) -> str:
+    return f"Response: {resp}" if VERBOSE else f"RequestId: {resp.RequestId}"
+
 def upload_certificate(keyPath: str, certificatePath: str):
     req = models.UploadCertificateRequest()
 
@@ -56,7 +201,7 @@ def upload_certificate(keyPath: str, certificatePath: str):
         req.CertificatePublicKey = f.read()
 
     resp = TENCENT_SSL_CLIENT.UploadCertificate(req)
-    print(f"[*] Uploaded certificate. Response: {resp}")
+    print(f"[*] Uploaded certificate {resp.CertificateId}. {describe_response(resp)}")
 
 def update_certificate(certificateID: str, types: list[str], types_regions: dict[str, list[str]], keyPath: str, certificatePath: str):
     req = models.UpdateCertificateInstanceRequest()
@@ -80,28 +225,62 @@ def update_certificate(certificateID: str, types: list[str], types_regions: dict
     req.AllowDownload = True
 
     resp = TENCENT_SSL_CLIENT.UpdateCertificateInstance(req)
-    print(f"[*] Updated certificate {certificateID}. Response: {resp}")
+    print(f"[*] Updated certificate {certificateID}, deploy record {resp.DeployRecordId}. {describe_response(resp)}")
+
+def domains_to_renew(domains: list[str]) -> list[str]:
+    due = []
+    deadline = datetime.now(timezone.utc) + timedelta(days=RENEW_DAYS)
+    for domain in domains:
+        try:
+            _, notAfter = read_certificate_validity(f"{CONFIG_HOME}/{domain}_ecc/fullchain.cer")
+        except (OSError, subprocess.CalledProcessError, KeyError, ValueError) as e:
+            print(f"[!] [{domain}] Cannot read local certificate, renewing: {e!r}")
+            due.append(domain)
+            continue
+        if notAfter <= deadline:
+            print(f"[*] [{domain}] Certificate expires at {notAfter}, renewing.")
+            due.append(domain)
+    return due
+
+def renew_certificate(domain: str):
+    try:
+        with trace_span("acme.renew"):
+            result = subprocess.run(
+                [f"{HOME}/acme.sh", "--renew", "--ecc", "-d", domain, "--home", HOME, "--config-home", CONFIG_HOME],
+                capture_output=True, text=True, timeout=ACME_TIMEOUT,
+            )
+    except subprocess.TimeoutExpired as e:
+        print(f"[!] [{domain}] acme.sh timed out after {ACME_TIMEOUT}s. Output: {e.stdout}")
+        return
+    # acme.sh exits with 2 when the renewal is skipped.
+    level = "*" if result.returncode in (0, 2) else "!"
+    print(f"[{level}] [{domain}] acme.sh exited with {result.returncode}. Output: {result.stdout}{result.stderr}")
 
 def handle_domain(domain: str, domain_config: dict):
     types = domain_config.get("types", [])
     types_regions = domain_config.get("types_regions", [])
 
     # Search latest certificate.
-    certificateID = search_latest_certificate(domain)
-    print(f"[*] Latest certificate ID: {certificateID}")
+    certificate = search_latest_certificate(domain)
+    certificateID = certificate.CertificateId
+    print(f"[*] [{domain}] Latest certificate ID: {certificateID}")
 
-    # Download online certificate.
-    onlineCert = download_certificate(domain, certificateID)
-    print(f"[*] Online certificate: {onlineCert}")
+    # Check if the certificate is renewed by comparing validity periods.
+    localBegin, localEnd = read_certificate_validity(f"{CONFIG_HOME}/{domain}_ecc/fullchain.cer")
+    onlineBegin, onlineEnd = online_certificate_validity(certificate)
+    print(f"[*] [{domain}] Local certificate: {localBegin} - {localEnd}, online certificate: {onlineBegin} - {onlineEnd}")
 
-    # Check if the certificate is renewed.
-    with open(f"{CONFIG_HOME}/{domain}_ecc/fullchain.cer", "rb") as f:
-        localCert = f.read()
-        print(f"[*] Local certificate: {localCert}")
+    if (localBegin, localEnd) == (onlineBegin, onlineEnd):
+        print(f"[*] [{domain}] Certificate is not renewed.")
+        return "Not Renewed"
 
-        if onlineCert == localCert:
-            print("[*] Certificate is not renewed.")
-            return "Not Renewed"
+    if localBegin < onlineBegin or localEnd < onlineEnd:
+        # Ambiguous metadata, fall back to comparing the certificate contents.
+        onlineCert = download_certificate(domain, certificateID)
+        with open(f"{CONFIG_HOME}/{domain}_ecc/fullchain.cer", "rb") as f:
+            if onlineCert == f.read():
+                print(f"[*] [{domain}] Certificate is not renewed.")
+                return "Not Renewed"
 
     # Update renewed certificate.
     update_certificate(certificateID, types, types_regions,
@@ -113,12 +292,39 @@ def handle_domain(domain: str, domain_config: dict):
 
 def main_handler(event, context):
     params = json.loads(event["Message"])
+    with TRACE_LOCK:
+        TRACE_LATENCIES.clear()
+
+    # Renew only the certificates inside the renewal window.
+    for domain in domains_to_renew(list(params)):
+        renew_certificate(domain)
 
-    # Renew all the certificates.
-    os.system(f"{HOME}/acme.sh --cron --home {HOME} --config-home {CONFIG_HOME}")
+    # Index the uploaded certificates once for all the domains.
+    certificate_index()
 
-    # Check each domain.
-    for domain, domain_config in params.items():
+    # Check all the domains concurrently, one failing domain must not abort the others.
+    def run(domain: str, domain_config: dict) -> dict:
         print(f"[*] Handling domain: {domain}")
-        result = handle_domain(domain, domain_config)
-        print(f"[*] Result: {result}")
\ No newline at end of file
+        start = time.monotonic()
+        try:
+            with trace_span("handle_domain"):
+                result = handle_domain(domain, domain_config)
+            return {"result": result, "duration": round(time.monotonic() - start, 3)}
+        except Exception as e:
+            print(f"[!] [{domain}] Failed: {e!r}")
+            return {"result": "Failed", "error": repr(e), "duration": round(time.monotonic() - start, 3)}
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {domain: executor.submit(run, domain, domain_config) for domain, domain_config in params.items()}
+        results = {domain: future.result() for domain, future in futures.items()}
+
+    # Renewed certificates replace indexed ones, so the next invocation must list again.
+    if any(result["result"] == "Done" for result in results.values()):
+        invalidate_certificate_index()
+
+    summary = trace_summary()
+    print(f"[*] Trace summary: {json.dumps(summary)}")
+    if TRACE_FILE:
+        with open(TRACE_FILE, "a") as f:
+            f.write(json.dumps({"type": "summary", "operations": summary}) + "\n")
+    return results
\ No newline at end of file